@@ -0,0 +1,93 @@
+"""
+Long-lived conversion worker for PooledConverter.
+
+Reads one JSON job per line from stdin and writes one JSON reply per line to stdout.
+Run it inside Calibre's interpreter, for example with calibre-debug -e converter_worker.py,
+so conversions run in-process without paying ebook-convert startup for every job.
+With --fake it writes a minimal placeholder EPUB instead, for testing without Calibre.
+"""
+import json
+import os
+import os.path
+import sys
+import traceback
+from zipfile import *
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_memory():
+    """
+    Get the peak memory use of this process.
+
+    Args:
+        Nothing.
+
+    Returns:
+        Peak memory use in bytes, None if unknown.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def fake_convert(arguments):
+    """
+    Write a minimal EPUB to the destination of a conversion.
+
+    Args:
+        arguments: Arguments to ebook-convert.
+
+    Returns:
+        Exit code of the conversion.
+    """
+    source, destination = arguments[0], arguments[1]
+    title = os.path.splitext(os.path.basename(source))[0]
+    if "--title" in arguments:
+        title = arguments[arguments.index("--title") + 1]
+    with ZipFile(destination, "w") as epub:
+        epub.writestr("mimetype", "application/epub+zip", ZIP_STORED)
+        epub.writestr("META-INF/container.xml", "<?xml version=\"1.0\"?>\n<container version=\"1.0\" xmlns=\"urn:oasis:names:tc:opendocument:xmlns:container\"><rootfiles><rootfile full-path=\"content.opf\" media-type=\"application/oebps-package+xml\"/></rootfiles></container>")
+        epub.writestr("content.opf", "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<package xmlns=\"http://www.idpf.org/2007/opf\" unique-identifier=\"uuid_id\" version=\"2.0\">\n  <metadata xmlns:dc=\"http://purl.org/dc/elements/1.1/\" xmlns:opf=\"http://www.idpf.org/2007/opf\">\n    <dc:title>{0}</dc:title>\n  </metadata>\n  <manifest/>\n  <spine/>\n</package>".format(title))
+    return 0
+
+def calibre_convert(arguments):
+    """
+    Run ebook-convert in this process.
+
+    Args:
+        arguments: Arguments to ebook-convert.
+
+    Returns:
+        Exit code of the conversion.
+    """
+    from calibre.ebooks.conversion.cli import main as ebook_convert
+    try:
+        return ebook_convert(["ebook-convert", *arguments]) or 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+
+def main():
+    # Keep the real stdout for replies and send anything else printed, including while importing Calibre, to stderr.
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    convert = fake_convert if "--fake" in sys.argv else calibre_convert
+    if convert is calibre_convert:
+        import calibre.ebooks.conversion.cli
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            returncode = convert(job["arguments"])
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        replies.write(json.dumps({"returncode": returncode, "rss": peak_memory()}) + "\n")
+        replies.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import json
+import queue
+import subprocess
+import threading
+
+class SubprocessConverter:
+    """
+    Runs every conversion as a new process.
+
+    Attributes:
+        _timeout: Seconds a conversion may take before it is killed, None for no limit.
+    """
+    def __init__(self, timeout=None):
+        """
+        Initialize SubprocessConverter class with given timeout.
+
+        Args:
+            timeout: Seconds a conversion may take before it is killed, None for no limit.
+
+        Returns:
+            Nothing.
+        """
+        self._timeout = timeout
+
+    def convert(self, command):
+        """
+        Run a conversion.
+
+        Args:
+            command: Command list for the conversion.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            subprocess.CalledProcessError: If the conversion fails.
+            subprocess.TimeoutExpired: If the conversion takes longer than the timeout.
+        """
+        subprocess.run(command, check=True, timeout=self._timeout)
+
+    def close(self):
+        """
+        Release any resources held by the converter.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        pass
+
+class WorkerDiedError(Exception):
+    """A conversion worker exited without replying to a job."""
+
+class _Worker:
+    """
+    A long-lived conversion worker process, speaking one line of JSON per job and reply over its stdin and stdout.
+
+    Attributes:
+        process: The worker Popen object.
+        jobs: Number of jobs the worker has run.
+        rss: Peak memory use of the worker in bytes as last reported, None if unknown.
+        _replies: Queue of replies read from the worker, None once it exits.
+    """
+    def __init__(self, command):
+        """
+        Initialize _Worker class by starting the worker process.
+
+        Args:
+            command: Command list to start the worker.
+
+        Returns:
+            Nothing.
+        """
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self.jobs = 0
+        self.rss = None
+        self._replies = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        """
+        Read replies from the worker until it exits or writes something that is not a reply,
+        which is treated the same as the worker exiting.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        try:
+            for line in self.process.stdout:
+                reply = json.loads(line)
+                if not isinstance(reply, dict) or "returncode" not in reply:
+                    break
+                self._replies.put(reply)
+        except ValueError:
+            pass
+        finally:
+            self._replies.put(None)
+
+    def run(self, command, arguments, timeout):
+        """
+        Run a conversion job on the worker.
+
+        Args:
+            command: Full command list of the conversion, for errors.
+            arguments: Arguments to the conversion program.
+            timeout: Seconds the job may take before the worker is killed, None for no limit.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            subprocess.CalledProcessError: If the conversion fails.
+            subprocess.TimeoutExpired: If the job takes longer than timeout.
+            WorkerDiedError: If the worker exits without replying.
+        """
+        try:
+            self.process.stdin.write(json.dumps({"arguments": arguments}) + "\n")
+            self.process.stdin.flush()
+        except OSError:
+            raise WorkerDiedError()
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise subprocess.TimeoutExpired(command, timeout)
+        if reply is None:
+            raise WorkerDiedError()
+        self.jobs += 1
+        self.rss = reply.get("rss")
+        if reply["returncode"] != 0:
+            raise subprocess.CalledProcessError(reply["returncode"], command)
+
+    def kill(self):
+        """
+        Kill the worker.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        self.process.kill()
+        self.process.wait()
+
+    def close(self):
+        """
+        Ask the worker to exit by closing its stdin, killing it if it does not.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+class PooledConverter:
+    """
+    Runs conversions on a pool of long-lived worker processes, so program startup is paid once per worker instead of once per conversion.
+    Workers are recycled after a number of jobs or once they use too much memory.
+    Conversions fall back to a SubprocessConverter if a worker dies, and for good if workers cannot start at all.
+
+    Attributes:
+        _program: Command list of the conversion program, stripped from commands before they are sent to a worker.
+        _worker_command: Command list to start a worker.
+        _size: Maximum number of workers.
+        _max_jobs: Number of jobs after which a worker is replaced, None for no limit.
+        _max_memory: Peak memory use in bytes after which a worker is replaced, None for no limit.
+        _timeout: Seconds a conversion may take before it is killed, None for no limit.
+        _fallback: SubprocessConverter used when workers are unavailable.
+        _idle: List of idle workers.
+        _started: Number of workers currently alive.
+        _broken: Whether workers have failed to start, disabling the pool.
+        _condition: Condition guarding the pool state.
+    """
+    def __init__(self, program, worker_command, size, max_jobs=None, max_memory=None, timeout=None):
+        """
+        Initialize PooledConverter class with given worker settings.
+
+        Args:
+            program: Command list of the conversion program.
+            worker_command: Command list to start a worker.
+            size: Maximum number of workers.
+            max_jobs: Number of jobs after which a worker is replaced, None for no limit.
+            max_memory: Peak memory use in bytes after which a worker is replaced, None for no limit.
+            timeout: Seconds a conversion may take before it is killed, None for no limit.
+
+        Returns:
+            Nothing.
+        """
+        self._program = program
+        self._worker_command = worker_command
+        self._size = size
+        self._max_jobs = max_jobs
+        self._max_memory = max_memory
+        self._timeout = timeout
+        self._fallback = SubprocessConverter(timeout)
+        self._idle = []
+        self._started = 0
+        self._broken = False
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        """
+        Take an idle worker, starting one if the pool is not full, otherwise waiting for one.
+
+        Args:
+            Nothing.
+
+        Returns:
+            A _Worker, None if the pool is broken.
+        """
+        with self._condition:
+            while not self._idle and self._started >= self._size and not self._broken:
+                self._condition.wait()
+            if self._broken:
+                return None
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            return _Worker(self._worker_command)
+        except OSError:
+            self._discard(None, broken=True)
+            return None
+
+    def _release(self, worker):
+        """
+        Return a worker to the pool, replacing it if it has run too many jobs or uses too much memory.
+
+        Args:
+            worker: The _Worker to return.
+
+        Returns:
+            Nothing.
+        """
+        if (self._max_jobs is not None and worker.jobs >= self._max_jobs) or (self._max_memory is not None and worker.rss is not None and worker.rss >= self._max_memory):
+            worker.close()
+            self._discard(None)
+            return
+        with self._condition:
+            self._idle.append(worker)
+            self._condition.notify()
+
+    def _discard(self, worker, broken=False):
+        """
+        Remove a worker from the pool.
+
+        Args:
+            worker: The _Worker to kill, None if it is already gone.
+            broken: Whether to disable the pool.
+
+        Returns:
+            Nothing.
+        """
+        if worker is not None and worker.process.poll() is None:
+            worker.kill()
+        with self._condition:
+            self._started -= 1
+            self._broken = self._broken or broken
+            self._condition.notify_all()
+
+    def convert(self, command):
+        """
+        Run a conversion on a worker.
+
+        Args:
+            command: Command list for the conversion.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            subprocess.CalledProcessError: If the conversion fails.
+            subprocess.TimeoutExpired: If the conversion takes longer than the timeout.
+        """
+        worker = self._acquire()
+        if worker is None:
+            self._fallback.convert(command)
+            return
+        try:
+            worker.run(command, command[len(self._program):], self._timeout)
+        except WorkerDiedError:
+            self._discard(worker, broken=worker.jobs == 0)
+            self._fallback.convert(command)
+        except subprocess.TimeoutExpired:
+            self._discard(worker)
+            raise
+        except subprocess.CalledProcessError:
+            self._release(worker)
+            raise
+        else:
+            self._release(worker)
+
+    def close(self):
+        """
+        Stop all idle workers.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+            self._started -= len(idle)
+        for worker in idle:
+            worker.close()
+
+def create_converter(calibre_settings):
+    """
+    Create the converter described by the Calibre settings.
+
+    Args:
+        calibre_settings: Settings for using Calibre.
+
+    Returns:
+        PooledConverter if calibre_settings["pool"]["size"] is positive, otherwise SubprocessConverter.
+    """
+    pool_settings = calibre_settings.get("pool", {})
+    timeout = calibre_settings.get("timeout")
+    if pool_settings.get("size", 0) > 0:
+        return PooledConverter(calibre_settings["convert"], pool_settings["worker"], pool_settings["size"], pool_settings.get("max_jobs"), pool_settings.get("max_memory"), timeout)
+    return SubprocessConverter(timeout)
@@ -0,0 +1,353 @@
+import os
+import os.path
+import posixpath
+import re
+import uuid
+from urllib.parse import quote, unquote
+from xml.dom import minidom
+from zipfile import *
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+TEXT_ENTRY_EXTENSIONS = [".opf", ".ncx", ".html", ".xhtml", ".htm", ".svg"]
+
+REFERENCE_PATTERN = re.compile(rb"(?<=\s)((?:xlink:)?(?:src|href)\s*=\s*)([\"'])(.*?)\2", re.DOTALL)
+
+DETERMINISTIC_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+DETERMINISTIC_TIMESTAMP = "1980-01-01T00:00:00+00:00"
+
+def find_opf(epub_zip_file):
+    """
+    Find the OPF package document of an EPUB.
+
+    Args:
+        epub_zip_file: ZipFile of the EPUB.
+
+    Returns:
+        Name of the OPF entry.
+    """
+    container = minidom.parseString(epub_zip_file.read("META-INF/container.xml"))
+    return container.getElementsByTagName("rootfile")[0].getAttribute("full-path")
+
+def _children(parent, tag_name):
+    """
+    Get the child elements of parent with a given tag name, ignoring namespace prefixes.
+
+    Args:
+        parent: Element to search.
+        tag_name: Local tag name to search for.
+
+    Returns:
+        List of matching child elements.
+    """
+    return [node for node in parent.childNodes if node.nodeType == node.ELEMENT_NODE and node.tagName.split(":")[-1] == tag_name]
+
+def _prefix(element, namespace, default):
+    """
+    Get a prefix bound to a namespace on element or its ancestors, binding default on element if there is none.
+    The default namespace is never used, so the prefix is valid for attributes too.
+
+    Args:
+        element: Element to start searching from.
+        namespace: Namespace URI.
+        default: Prefix to bind if the namespace has no prefix.
+
+    Returns:
+        The prefix as str.
+    """
+    node = element
+    while node is not None and node.nodeType == node.ELEMENT_NODE:
+        for name, value in node.attributes.items():
+            if value == namespace and name.startswith("xmlns:"):
+                return name[len("xmlns:"):]
+        node = node.parentNode
+    element.setAttribute("xmlns:{0}".format(default), namespace)
+    return default
+
+def _qualify(prefix, name):
+    """
+    Qualify a name with a prefix.
+
+    Args:
+        prefix: The prefix, "" for the default namespace.
+        name: The local name.
+
+    Returns:
+        The qualified name.
+    """
+    return "{0}:{1}".format(prefix, name) if prefix else name
+
+def _role(element, opf):
+    """
+    Get the opf:role of a dc:creator or dc:contributor element.
+
+    Args:
+        element: The element.
+        opf: Prefix of the OPF namespace.
+
+    Returns:
+        The role as str, "" if it has none.
+    """
+    return element.getAttribute(_qualify(opf, "role")) or element.getAttribute("role")
+
+def apply_opf_metadata(opf, metadata):
+    """
+    Apply metadata to an OPF 2 package document as written by Calibre.
+    Only fields that are set in metadata are changed.
+
+    Args:
+        opf: Content of the OPF as bytes.
+        metadata: Metadata object for the work.
+
+    Returns:
+        New content of the OPF as bytes.
+    """
+    document = minidom.parseString(opf)
+    package = document.documentElement
+    metadata_element = _children(package, "metadata")[0]
+    dc = _prefix(metadata_element, "http://purl.org/dc/elements/1.1/", "dc")
+    opf_prefix = _prefix(metadata_element, "http://www.idpf.org/2007/opf", "opf")
+    package_prefix = package.tagName.split(":")[0] if ":" in package.tagName else ""
+
+    def remove(elements):
+        for element in elements:
+            previous = element.previousSibling
+            if previous is not None and previous.nodeType == previous.TEXT_NODE and not previous.data.strip():
+                metadata_element.removeChild(previous)
+            metadata_element.removeChild(element)
+
+    def add(tag_name, text, attributes={}):
+        element = document.createElement(tag_name)
+        for name, value in attributes.items():
+            element.setAttribute(name, value)
+        element.appendChild(document.createTextNode(text))
+        metadata_element.appendChild(element)
+
+    def set_dc(name, values, keep=lambda element: False, attributes={}):
+        remove([element for element in _children(metadata_element, name) if not keep(element)])
+        for value in values:
+            add(_qualify(dc, name), value, attributes)
+
+    def set_calibre(name, value):
+        remove([element for element in _children(metadata_element, "meta") if element.getAttribute("name") == "calibre:{0}".format(name)])
+        element = document.createElement(_qualify(package_prefix, "meta"))
+        element.setAttribute("name", "calibre:{0}".format(name))
+        element.setAttribute("content", value)
+        metadata_element.appendChild(element)
+
+    if metadata.title:
+        set_dc("title", [metadata.title])
+    if metadata.authors:
+        authors = [author.strip() for author in metadata.authors.split("&") if author.strip()]
+        set_dc("creator", authors, keep=lambda element: _role(element, opf_prefix) not in ["", "aut"], attributes={_qualify(opf_prefix, "role"): "aut"})
+    if metadata.author_sort:
+        # Calibre's author sort is a single value for the book, stored on the first author.
+        for element in _children(metadata_element, "creator"):
+            if _role(element, opf_prefix) in ["", "aut"]:
+                element.setAttribute(_qualify(opf_prefix, "file-as"), metadata.author_sort)
+                break
+    if metadata.book_producer:
+        set_dc("contributor", [metadata.book_producer], keep=lambda element: _role(element, opf_prefix) != "bkp", attributes={_qualify(opf_prefix, "role"): "bkp"})
+    if metadata.comments:
+        set_dc("description", [metadata.comments])
+    if metadata.isbn:
+        scheme = _qualify(opf_prefix, "scheme")
+        set_dc("identifier", [metadata.isbn], keep=lambda element: element.getAttribute(scheme).upper() != "ISBN", attributes={scheme: "ISBN"})
+    if metadata.language:
+        set_dc("language", [metadata.language])
+    if metadata.pubdate:
+        event = _qualify(opf_prefix, "event")
+        set_dc("date", [metadata.pubdate], keep=lambda element: element.getAttribute(event) not in ["", "publication"])
+    if metadata.publisher:
+        set_dc("publisher", [metadata.publisher])
+    if metadata.tags:
+        set_dc("subject", [tag.strip() for tag in metadata.tags.split(",") if tag.strip()])
+    if metadata.rating:
+        set_calibre("rating", "{0:g}".format(float(metadata.rating) * 2))
+    if metadata.series:
+        set_calibre("series", metadata.series)
+    if metadata.series_index:
+        set_calibre("series_index", metadata.series_index)
+    if metadata.title_sort:
+        set_calibre("title_sort", metadata.title_sort)
+
+    return document.toxml(encoding="utf-8")
+
+def _find_cover_item(opf):
+    """
+    Find the manifest item of the cover image in an OPF package document.
+
+    Args:
+        opf: Parsed OPF as a minidom Document.
+
+    Returns:
+        The manifest item element, None if the EPUB has no cover image.
+    """
+    package = opf.documentElement
+    cover_id = None
+    for metadata_element in _children(package, "metadata"):
+        for meta in _children(metadata_element, "meta"):
+            if meta.getAttribute("name") == "cover":
+                cover_id = meta.getAttribute("content")
+    if cover_id is None:
+        return None
+    for manifest in _children(package, "manifest"):
+        for item in _children(manifest, "item"):
+            if item.getAttribute("id") == cover_id:
+                return item
+    return None
+
+def _rename_references(entry_name, data, old_name, new_name):
+    """
+    Rewrite the src and href attributes in a text entry of an EPUB that refer to a renamed entry.
+
+    Args:
+        entry_name: Name of the text entry.
+        data: Content of the text entry as bytes.
+        old_name: Old name of the renamed entry.
+        new_name: New name of the renamed entry.
+
+    Returns:
+        New content of the text entry as bytes.
+    """
+    directory = posixpath.dirname(entry_name)
+
+    def rename(match):
+        try:
+            url = match.group(3).decode("utf-8")
+        except UnicodeDecodeError:
+            return match.group(0)
+        path, suffix = re.match(r"([^?#]*)(.*)", url, re.DOTALL).groups()
+        if not path or re.match(r"[A-Za-z][A-Za-z0-9+.-]*:", path) or posixpath.normpath(posixpath.join(directory, unquote(path))) != old_name:
+            return match.group(0)
+        new_path = quote(posixpath.relpath(new_name, directory or "."), safe="/")
+        return match.group(1) + match.group(2) + (new_path + suffix).encode("utf-8") + match.group(2)
+    return REFERENCE_PATTERN.sub(rename, data)
+
+def update_epub_metadata(epub, metadata, cover=None):
+    """
+    Update the metadata and cover of an existing EPUB without rebuilding it.
+    The OPF is rewritten, the cover image is replaced if a cover is given, and every other entry is copied unchanged
+    apart from references to a cover renamed for a new image type. The EPUB is replaced atomically.
+
+    Args:
+        epub: Path to the EPUB.
+        metadata: Metadata object for the work.
+        cover: Path to the cover file to use, None to keep the current cover.
+            Calibre re-encodes the covers it embeds, so callers should only pass a cover that changed since the build.
+            An EPUB built without a cover needs a full rebuild to gain one.
+
+    Returns:
+        Bool whether the cover image was replaced, False if no cover was given or the EPUB has no cover image.
+    """
+    replacements = {}
+    renames = {}
+    with ZipFile(epub, "r") as epub_zip_file:
+        opf_name = find_opf(epub_zip_file)
+        opf = minidom.parseString(apply_opf_metadata(epub_zip_file.read(opf_name), metadata))
+
+        item = _find_cover_item(opf) if cover is not None else None
+        if item is not None:
+            old_cover_name = posixpath.normpath(posixpath.join(posixpath.dirname(opf_name), item.getAttribute("href")))
+            with open(cover, "rb") as f:
+                cover_data = f.read()
+            old_stem, old_ext = posixpath.splitext(old_cover_name)
+            new_ext = os.path.splitext(cover)[1].lower()
+            if new_ext != old_ext.lower() and new_ext in MEDIA_TYPES:
+                new_cover_name = old_stem + new_ext
+                renames[old_cover_name] = new_cover_name
+                item.setAttribute("href", posixpath.splitext(item.getAttribute("href"))[0] + new_ext)
+                item.setAttribute("media-type", MEDIA_TYPES[new_ext])
+            else:
+                new_cover_name = old_cover_name
+            replacements[old_cover_name] = (new_cover_name, cover_data)
+        replacements[opf_name] = (opf_name, opf.toxml(encoding="utf-8"))
+
+        temporary = "{0}.tmp".format(epub)
+        try:
+            with ZipFile(temporary, "w") as new_epub_zip_file:
+                for info in epub_zip_file.infolist():
+                    if info.filename in replacements:
+                        name, data = replacements[info.filename]
+                    else:
+                        name, data = info.filename, epub_zip_file.read(info)
+                    if renames and os.path.splitext(name)[1].lower() in TEXT_ENTRY_EXTENSIONS:
+                        for old, new in renames.items():
+                            data = _rename_references(name, data, old, new)
+                    if name != info.filename:
+                        new_info = ZipInfo(name, info.date_time)
+                        new_info.compress_type = info.compress_type
+                        new_info.external_attr = info.external_attr
+                        info = new_info
+                    new_epub_zip_file.writestr(info, data)
+        except BaseException:
+            os.remove(temporary)
+            raise
+    os.replace(temporary, epub)
+    return item is not None
+
+def normalize_epub(epub, identifier, timestamp=DETERMINISTIC_TIMESTAMP):
+    """
+    Rewrite an EPUB so identical inputs always give identical bytes.
+    Entries are sorted with mimetype first and given fixed zip timestamps and permissions,
+    generated UUIDs are replaced with UUIDs derived from identifier, and generated timestamps are fixed.
+    The EPUB is replaced atomically.
+
+    Args:
+        epub: Path to the EPUB.
+        identifier: Stable identifier of the work as str, such as its grouping and name.
+        timestamp: Timestamp to use instead of generated ones, in ISO 8601 format.
+
+    Returns:
+        Nothing.
+    """
+    with ZipFile(epub, "r") as epub_zip_file:
+        opf_name = find_opf(epub_zip_file)
+        opf = minidom.parseString(epub_zip_file.read(opf_name))
+        metadata_element = _children(opf.documentElement, "metadata")[0]
+
+        uuids = {}
+        for element in _children(metadata_element, "identifier"):
+            value = "".join(node.data for node in element.childNodes if node.nodeType == node.TEXT_NODE).strip()
+            scheme = next((v for k, v in element.attributes.items() if k.split(":")[-1] == "scheme"), "").lower()
+            if value.startswith("urn:uuid:"):
+                value = value[len("urn:uuid:"):]
+            elif scheme not in ["uuid", "calibre"]:
+                continue
+            uuids[value.encode("utf-8")] = str(uuid.uuid5(uuid.NAMESPACE_URL, "{0}#{1}".format(identifier, len(uuids)))).encode("utf-8")
+        for element in _children(metadata_element, "meta"):
+            if element.getAttribute("name") == "calibre:timestamp":
+                element.setAttribute("content", timestamp)
+            elif element.getAttribute("property") == "dcterms:modified":
+                while element.firstChild is not None:
+                    element.removeChild(element.firstChild)
+                element.appendChild(opf.createTextNode(timestamp.replace("+00:00", "Z")))
+
+        entries = []
+        for info in epub_zip_file.infolist():
+            data = opf.toxml(encoding="utf-8") if info.filename == opf_name else epub_zip_file.read(info)
+            if os.path.splitext(info.filename)[1].lower() in TEXT_ENTRY_EXTENSIONS:
+                for old, new in uuids.items():
+                    data = data.replace(old, new)
+            entries.append((info.filename, info.compress_type, data))
+
+    entries.sort(key=lambda entry: (entry[0] != "mimetype", entry[0]))
+    temporary = "{0}.tmp".format(epub)
+    try:
+        with ZipFile(temporary, "w") as new_epub_zip_file:
+            for name, compress_type, data in entries:
+                info = ZipInfo(name, DETERMINISTIC_DATE_TIME)
+                info.compress_type = ZIP_STORED if name == "mimetype" else compress_type
+                info.create_system = 0
+                info.external_attr = 0o644 << 16
+                new_epub_zip_file.writestr(info, data)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    os.replace(temporary, epub)
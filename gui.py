@@ -1,5 +1,6 @@
 from library import *
 from filters import *
+from thumbnails import *
 
 import os.path
 from PySide2.QtCore import *
@@ -15,6 +16,7 @@ class Builder(QMainWindow):
         self.library = library
         self.grouping = None
         self.work = None
+        self.thumbnailCache = None
 
         QApplication.setStyle("Fusion")
         QApplication.setPalette(QApplication.style().standardPalette())
@@ -49,7 +51,7 @@ class Builder(QMainWindow):
         mainMenu.addAction(browseAction)
         
         regenerateAction = QAction("Regenerate", self)
-        regenerateAction.triggered.connect(self.library.regenerate)
+        regenerateAction.triggered.connect(lambda: self.library.regenerate())
         mainMenu.addAction(regenerateAction)
 
     def createHeader(self):
@@ -60,11 +62,15 @@ class Builder(QMainWindow):
         buildButton = QPushButton("Build EPUB")
         buildButton.clicked.connect(self.buildEPUB)
 
+        metadataButton = QPushButton("Update Metadata")
+        metadataButton.clicked.connect(self.applyMetadata)
+
         openButton = QPushButton("Open EPUB")
         openButton.clicked.connect(self.openEPUB)
 
         layout.addWidget(self.label, 5)
         layout.addWidget(buildButton, 1)
+        layout.addWidget(metadataButton, 1)
         layout.addWidget(openButton, 1)
 
         self.mainLayout.addLayout(layout, 0, 0)
@@ -105,19 +111,46 @@ class Builder(QMainWindow):
     def openWork(self, grouping):
         WorkSelector(self, grouping).show()
 
+    def getThumbnailCache(self):
+        if self.thumbnailCache is None:
+            self.thumbnailCache = ThumbnailCache(self.library.thumbnail_cache_directory, self.library.thumbnail_max_bytes)
+        return self.thumbnailCache
+
     def browse(self):
         if not self.label.text():
             url = QUrl.fromLocalFile(os.path.abspath(self.library.root_directory))
         else:
-            url = QUrl.fromLocalFile(os.path.abspath(os.path.join(self.library.root_directory, self.label.text()))).url()
+            url = QUrl.fromLocalFile(os.path.abspath(self.library.work_directory(self.grouping, self.work))).url()
         QDesktopServices.openUrl(url)
 
     def buildEPUB(self):
         if not self.grouping:
             messageBox = QMessageBox(QMessageBox.Critical, "Error", "No work has been selected!")
             messageBox.exec()
-        else:
-            self.library.build_epub(self.grouping, self.work)
+            return
+        try:
+            if not self.library.build_epub(self.grouping, self.work):
+                messageBox = QMessageBox(QMessageBox.Warning, "Skipped", "This work is already being built!")
+                messageBox.exec()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, TimeoutError, ValueError, OSError) as e:
+            messageBox = QMessageBox(QMessageBox.Critical, "Error", "Building the EPUB failed!\n{0}".format(e))
+            messageBox.exec()
+
+    def applyMetadata(self):
+        if not self.grouping:
+            messageBox = QMessageBox(QMessageBox.Critical, "Error", "No work has been selected!")
+            messageBox.exec()
+            return
+        try:
+            if not self.library.apply_metadata(self.grouping, self.work):
+                messageBox = QMessageBox(QMessageBox.Warning, "Skipped", "This work is already being built!")
+                messageBox.exec()
+        except FileNotFoundError:
+            messageBox = QMessageBox(QMessageBox.Critical, "Error", "No EPUB found!")
+            messageBox.exec()
+        except (TimeoutError, ValueError, OSError, BadZipFile) as e:
+            messageBox = QMessageBox(QMessageBox.Critical, "Error", "Updating the metadata failed!\n{0}".format(e))
+            messageBox.exec()
 
     def openEPUB(self):
         try:
@@ -131,7 +164,7 @@ class Builder(QMainWindow):
             messageBox = QMessageBox(QMessageBox.Critical, "Error", "No work has been selected!")
             messageBox.exec()
         elif self.library.is_comic(self.grouping):
-            destination = os.path.abspath(os.path.join(self.library.root_directory, self.label.text()))
+            destination = os.path.abspath(self.library.work_directory(self.grouping, self.work))
             dialog = QFileDialog(self, "Import Comic", directory=destination)
             dialog.setOption(QFileDialog.DontUseNativeDialog)
             dialog.setOption(QFileDialog.ShowDirsOnly, False)
@@ -146,7 +179,7 @@ class Builder(QMainWindow):
                 self.library.import_chapters(self.grouping, self.work, sources)
 
         elif self.library.is_text(self.grouping):
-            destination = os.path.abspath(os.path.join(self.library.root_directory, self.label.text()))
+            destination = os.path.abspath(self.library.work_directory(self.grouping, self.work))
             dialog = QFileDialog(self, "Import Text", directory=destination)
             dialog.setOption(QFileDialog.DontUseNativeDialog)
             dialog.setProxyModel(FileFilterProxyModel([".txt", ".html"], parent=dialog))
@@ -159,6 +192,96 @@ class Builder(QMainWindow):
                 sources = dialog.selectedFiles()
                 self.library.import_chapters(self.grouping, self.work, sources)
 
+class ThumbnailSignals(QObject):
+    loaded = Signal(str, QImage)
+
+class ThumbnailTask(QRunnable):
+    def __init__(self, library, cache, grouping, work, signals):
+        super(ThumbnailTask, self).__init__()
+
+        self.library = library
+        self.cache = cache
+        self.grouping = grouping
+        self.work = work
+        self.signals = signals
+
+    def run(self):
+        image = QImage()
+        try:
+            source = self.library.get_thumbnail_source(self.grouping, self.work)
+            if source is not None:
+                cache = self.cache
+                key = cache.key(source)
+                data = cache.get(key)
+                if data is not None:
+                    image = QImage.fromData(QByteArray(data))
+                else:
+                    image = self.decode(source, self.library.get_thumbnail_page(source))
+                    if not image.isNull():
+                        buffer = QBuffer()
+                        buffer.open(QIODevice.WriteOnly)
+                        image.save(buffer, "PNG")
+                        cache.put(key, bytes(buffer.data()))
+        except (OSError, BadZipFile):
+            image = QImage()
+        self.signals.loaded.emit(self.work, image)
+
+    def decode(self, path, member):
+        if member is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        else:
+            with ZipFile(path, "r") as z:
+                data = z.read(member)
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+        size = reader.size()
+        if size.isValid():
+            reader.setScaledSize(size.scaled(self.library.thumbnail_size, self.library.thumbnail_size, Qt.KeepAspectRatio))
+        return reader.read()
+
+class WorkListModel(QStandardItemModel):
+    def __init__(self, library, cache, grouping, *args, **kwargs):
+        super(WorkListModel, self).__init__(*args, **kwargs)
+
+        self.library = library
+        self.cache = cache
+        self.grouping = grouping
+        self.thumbnails = {}
+        self.showThumbnails = True
+        self.pool = QThreadPool(self)
+        self.signals = ThumbnailSignals()
+        self.signals.loaded.connect(self.setThumbnail)
+
+        for work in library.list_works(grouping):
+            item = QStandardItem(work)
+            item.setEditable(False)
+            self.appendRow(item)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DecorationRole and self.showThumbnails and index.isValid():
+            work = super(WorkListModel, self).data(index, Qt.DisplayRole)
+            if work not in self.thumbnails:
+                self.thumbnails[work] = None
+                self.pool.start(ThumbnailTask(self.library, self.cache, self.grouping, work, self.signals))
+            return self.thumbnails[work]
+        return super(WorkListModel, self).data(index, role)
+
+    def setThumbnail(self, work, image):
+        if image.isNull():
+            return
+        self.thumbnails[work] = QIcon(QPixmap.fromImage(image))
+        for item in self.findItems(work):
+            index = item.index()
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def setShowThumbnails(self, showThumbnails):
+        self.showThumbnails = showThumbnails
+        if self.rowCount() > 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, 0), [Qt.DecorationRole])
+
 class WorkSelector(QDialog):
     def __init__(self, parent, grouping):
         super(WorkSelector, self).__init__(parent)
@@ -169,40 +292,55 @@ class WorkSelector(QDialog):
 
         layout = QVBoxLayout()
 
-        model = QFileSystemModel(self)
-        model.setReadOnly(True)
-        model.setRootPath(os.path.join(self.parentWidget().library.root_directory, grouping.value))
-        proxyModel = WorkFilterProxyModel(parent=self)
-        proxyModel.setDynamicSortFilter(True)
-        proxyModel.setSourceModel(model)
+        self.model = WorkListModel(self.parentWidget().library, self.parentWidget().getThumbnailCache(), grouping, self)
+
+        view = QListView()
+        view.setModel(self.model)
+        view.setUniformItemSizes(True)
+        view.setResizeMode(QListView.Adjust)
+        view.setWordWrap(True)
+        view.doubleClicked.connect(lambda: self.makeSelection(view))
 
-        view = QTreeView()
-        view.setModel(proxyModel)
-        view.setRootIndex(proxyModel.mapFromSource(model.index(os.path.join(self.parentWidget().library.root_directory, grouping.value))))
-        view.header().setSectionResizeMode(QHeaderView.ResizeToContents)
-        view.header().setStretchLastSection(False)
+        gridButton = QPushButton("Grid")
+        gridButton.setCheckable(True)
+        gridButton.toggled.connect(lambda checked: self.setGrid(view, checked))
+        gridButton.setChecked(True)
 
         button = QPushButton("OK")
         button.clicked.connect(lambda: self.makeSelection(view))
 
+        layout.addWidget(gridButton)
         layout.addWidget(view)
         layout.addWidget(button)
 
         self.setLayout(layout)
         self.resize(self.parentWidget().size())
 
+    def setGrid(self, view, grid):
+        size = self.parentWidget().library.thumbnail_size
+        if grid:
+            view.setViewMode(QListView.IconMode)
+            view.setIconSize(QSize(size, size))
+            view.setGridSize(QSize(size + 16, size + 48))
+        else:
+            view.setViewMode(QListView.ListMode)
+            view.setIconSize(QSize())
+            view.setGridSize(QSize())
+        self.model.setShowThumbnails(grid)
+
+    def done(self, result):
+        self.model.pool.clear()
+        super(WorkSelector, self).done(result)
+
     def makeSelection(self, view):
         if len(view.selectedIndexes()) < 1:
             messageBox = QMessageBox(QMessageBox.Critical, "Error", "Nothing is selected!")
             messageBox.exec()
-        elif not view.model().sourceModel().isDir(view.model().mapToSource(view.selectedIndexes()[0])):
-            messageBox = QMessageBox(QMessageBox.Critical, "Error", "Invalid selection!")
-            messageBox.exec()
         else:
             if self.parentWidget().library.is_comic(self.grouping):
                 self.parentWidget().proxyModel = FileFilterProxyModel([".cbz"], dirs=False, parent=self.parentWidget())
             elif self.parentWidget().library.is_text(self.grouping):
-                self.parentWidget().proxyModel = FileFilterProxyModel([".html"], dirs=False, parent=self.parentWidget())
+                self.parentWidget().proxyModel = FileFilterProxyModel([os.path.splitext(extension)[1] for extension in TEXT_CHAPTER_EXTENSIONS.values()], dirs=False, parent=self.parentWidget())
             else:
                 messageBox = QMessageBox(QMessageBox.Critical, "Error", "Invalid selection!")
                 messageBox.exec()
@@ -210,14 +348,15 @@ class WorkSelector(QDialog):
             self.parentWidget().proxyModel.setDynamicSortFilter(True)
             self.parentWidget().proxyModel.setSourceModel(self.parentWidget().model)
 
-            root = view.model().sourceModel().filePath(view.model().mapToSource(view.selectedIndexes()[0]))
+            work = view.selectedIndexes()[0].data()
+            root = os.path.abspath(self.parentWidget().library.work_directory(self.grouping, work))
 
             shiboken2.delete(self.parentWidget().view.model())
             self.parentWidget().model.setRootPath(root)
             self.parentWidget().view.setModel(self.parentWidget().proxyModel)
             self.parentWidget().view.setRootIndex(self.parentWidget().proxyModel.mapFromSource(self.parentWidget().model.index(root)))
             self.parentWidget().grouping = self.grouping
-            self.parentWidget().work = view.model().sourceModel().fileName(view.model().mapToSource(view.selectedIndexes()[0]))
+            self.parentWidget().work = work
             self.parentWidget().label.setText(os.path.join(self.grouping.value, self.parentWidget().work))
             self.close()
 
@@ -0,0 +1,130 @@
+import json
+import os
+import os.path
+import threading
+import time
+
+class JobJournal:
+    """
+    A durable, append-only journal of the jobs in a batch operation.
+
+    Every state change is written as one line of JSON and synced to disk before the job continues,
+    so the journal survives crashes and a later run can resume from it.
+
+    Attributes:
+        _path: Path to the journal file.
+        _records: Dict of job to its latest record.
+        _lock: Lock guarding the journal file and _records.
+    """
+    def __init__(self, path, resume=False):
+        """
+        Initialize JobJournal class with given journal file.
+
+        Args:
+            path: Path to the journal file, created if missing.
+            resume: Whether to keep the records of a previous run, otherwise the journal is started afresh.
+
+        Returns:
+            Nothing.
+        """
+        self._path = path
+        self._records = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if resume and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash can leave a partial last line.
+                        continue
+                    self._records[record["job"]] = record
+            with open(path, "rb+") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+        elif not resume:
+            open(path, "w", encoding="utf-8").close()
+
+    def get(self, job):
+        """
+        Get the latest record of a job.
+
+        Args:
+            job: Name of the job as str.
+
+        Returns:
+            The record as a dict, None if the job has no records.
+        """
+        with self._lock:
+            return self._records.get(job)
+
+    def record(self, job, state, **fields):
+        """
+        Durably record a state change of a job.
+
+        Args:
+            job: Name of the job as str.
+            state: One of "queued", "running", "succeeded", "skipped" or "failed".
+            **fields: Extra fields to record, such as duration, attempt or error.
+
+        Returns:
+            Nothing.
+        """
+        record = {"job": job, "state": state, "time": time.time(), **fields}
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._records[job] = record
+
+    def failed(self):
+        """
+        List the jobs whose latest record is a failure.
+
+        Args:
+            Nothing.
+
+        Returns:
+            List of names of the failed jobs.
+        """
+        with self._lock:
+            return [job for job, record in self._records.items() if record["state"] == "failed"]
+
+    def summary(self, count=10):
+        """
+        Summarize the slowest and failing jobs.
+
+        Args:
+            count: Number of slowest jobs to list.
+
+        Returns:
+            The summary as str.
+        """
+        with self._lock:
+            records = list(self._records.values())
+        states = {}
+        for record in records:
+            states[record["state"]] = states.get(record["state"], 0) + 1
+        lines = [", ".join("{0} {1}".format(n, state) for state, n in sorted(states.items())) or "No jobs"]
+
+        finished = sorted((r for r in records if "duration" in r), key=lambda r: r["duration"], reverse=True)[:count]
+        if finished:
+            lines.append("")
+            lines.append("Slowest:")
+            for record in finished:
+                lines.append("  {0:10.1f}s  {1}".format(record["duration"], record["job"]))
+
+        failed = [r for r in records if r["state"] == "failed"]
+        if failed:
+            lines.append("")
+            lines.append("Failed:")
+            for record in failed:
+                lines.append("  {0} (attempt {1}): {2}".format(record["job"], record.get("attempt", 1), record.get("error", "")))
+        return "\n".join(lines)
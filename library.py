@@ -4,10 +4,22 @@ from enum import Enum
 import os
 import os.path
 import errno
+import shutil
 import subprocess
+import time
 
 from utility import *
 from metadata import *
+from scheduler import *
+from epub import update_epub_metadata, normalize_epub
+from converters import *
+from journal import *
+from sync import sync_files, sanitize_filename, hash_file
+from report import ReportCache, directory_signature, directory_size
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"]
+
+COVER_HASH_FILE = ".cover.sha256"
 
 class Library:
     """
@@ -18,11 +30,30 @@ class Library:
         _grouping: An Enum representing the different work groupings.
         _comics: List of comic groupings as str.
         _texts: List of text groupings as str.
-        _root_directory: Path to library root directory.
+        _root_directory: Path to the first library root directory, where groupings not found in any root are created.
+        _roots: List of paths to library root directories, searched in order.
+        _devices: Dict of root directory path to the device it is on.
+        _scheduler: DeviceScheduler limiting concurrent I/O on each device.
         _output_directory: Path to library output directory.
         _css_file: Path to the CSS file to use for conversions.
         _covers: List of paths to possible cover file names to use for conversions in search order.
         _calibre_settings: Settings for using Calibre.
+        _converter: Converter used to run conversion commands.
+        _text_compression: Compression to store imported text chapters with, None for plain .html files.
+        _archive_options: Compression options for write_archive when writing .cbz and .cbc archives.
+        _lock_policy: Either "wait" or "skip", what to do when a work is already being built.
+        _lock_timeout: Seconds to wait for a work being built elsewhere, None to wait forever.
+        _deterministic: Whether to normalize built EPUBs so identical inputs give identical bytes.
+        _thumbnail_size: Maximum width and height of work thumbnails in pixels.
+        _thumbnail_cache_directory: Path to the directory for cached work thumbnails.
+        _thumbnail_max_bytes: Maximum total size of the cached work thumbnails in bytes.
+        _journal_directory: Path to the directory for batch job journals.
+        _retries: Number of times a failed batch job is retried within a run.
+        _backoff: Seconds to wait before the first retry of a failed batch job, doubled for every further retry in the run.
+        _max_backoff: Maximum seconds to wait before retrying a failed batch job.
+        _sync_targets: Dict of name to path of directories to sync EPUBs to.
+        _sync_workers: Maximum number of EPUBs to copy at once when syncing.
+        _report_cache: Path to the cache file for library reports.
     """
     def __init__(self, config_file):
         """
@@ -43,12 +74,57 @@ class Library:
         self._comics = list(config["FORMATS"]["Comic"].values())
         self._texts = list(config["FORMATS"]["Text"].values())
 
-        self._root_directory = config["root"]
+        roots = config["root"] if isinstance(config["root"], list) else [config["root"]]
+        self._roots = []
+        self._devices = {}
+        device_limits = {}
+        for root in roots:
+            if isinstance(root, str):
+                root = {"path": root}
+            device = root.get("device", get_device(root["path"]))
+            self._roots.append(root["path"])
+            self._devices[root["path"]] = device
+            if "io_concurrency" in root:
+                device_limits[device] = root["io_concurrency"]
+        self._root_directory = self._roots[0]
+        self._scheduler = DeviceScheduler(device_limits, config.get("io_concurrency", 2))
         self._output_directory = config["output"]
         self._css_file = config["CSS"]
         self._covers = config["covers"]
 
         self._calibre_settings = config["Calibre"]
+        self._converter = create_converter(self._calibre_settings)
+        self._text_compression = config.get("text_compression")
+
+        archive_settings = config.get("archives", {})
+        self._archive_options = {
+            "compression": archive_settings.get("compression"),
+            "level": archive_settings.get("level", 6),
+            "stored_extensions": archive_settings.get("store", STORED_EXTENSIONS),
+            "workers": archive_settings.get("workers"),
+        }
+
+        build_settings = config.get("build", {})
+        self._lock_policy = build_settings.get("lock", "wait")
+        self._lock_timeout = build_settings.get("lock_timeout")
+        self._deterministic = build_settings.get("deterministic", False)
+
+        thumbnail_settings = config.get("thumbnails", {})
+        self._thumbnail_size = thumbnail_settings.get("size", 160)
+        self._thumbnail_cache_directory = thumbnail_settings.get("cache", ".cache/thumbnails")
+        self._thumbnail_max_bytes = thumbnail_settings.get("max_bytes", 64 * 1024 * 1024)
+
+        batch_settings = config.get("batch", {})
+        self._journal_directory = batch_settings.get("journal", ".cache/journals")
+        self._retries = batch_settings.get("retries", 0)
+        self._backoff = batch_settings.get("backoff", 5)
+        self._max_backoff = batch_settings.get("max_backoff", 60)
+
+        sync_settings = config.get("sync", {})
+        self._sync_targets = sync_settings.get("targets", {})
+        self._sync_workers = sync_settings.get("workers", 4)
+
+        self._report_cache = config.get("report", {}).get("cache", ".cache/report.json")
     
     @property
     def grouping(self):
@@ -62,9 +138,19 @@ class Library:
     
     @property
     def root_directory(self):
-        """Path to library root directory."""
+        """Path to the first library root directory."""
         return self._root_directory
     
+    @property
+    def roots(self):
+        """List of paths to library root directories."""
+        return self._roots
+
+    @property
+    def journal_directory(self):
+        """Path to the directory for batch job journals."""
+        return self._journal_directory
+
     @property
     def output_directory(self):
         """Path to library output directory."""
@@ -80,6 +166,34 @@ class Library:
         """List of paths to possible cover file names to use for conversions in search order."""
         return self._covers
 
+    @property
+    def thumbnail_size(self):
+        """Maximum width and height of work thumbnails in pixels."""
+        return self._thumbnail_size
+
+    @property
+    def thumbnail_cache_directory(self):
+        """Path to the directory for cached work thumbnails."""
+        return self._thumbnail_cache_directory
+
+    @property
+    def thumbnail_max_bytes(self):
+        """Maximum total size of the cached work thumbnails in bytes."""
+        return self._thumbnail_max_bytes
+
+    def close(self):
+        """
+        Stop background conversion workers and I/O threads.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        self._converter.close()
+        self._scheduler.shutdown()
+
     def is_comic(self, grouping):
         """
         Checks whether grouping is a comic.
@@ -108,6 +222,120 @@ class Library:
             return True
         return False
 
+    def work_directory(self, grouping, work):
+        """
+        Get the directory of a given grouping and work, searching every root.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work: Name of the work as str.
+
+        Returns:
+            Path to the directory of the work. For works not in any root,
+            the path in the first root containing the grouping, or the first root if none do.
+        """
+        for root in self._roots:
+            candidate = os.path.join(root, grouping.value, work)
+            if os.path.isdir(candidate):
+                return candidate
+        for root in self._roots:
+            if os.path.isdir(os.path.join(root, grouping.value)):
+                return os.path.join(root, grouping.value, work)
+        return os.path.join(self._root_directory, grouping.value, work)
+
+    def device_of(self, path):
+        """
+        Get the device a path in the library is on.
+
+        Args:
+            path: Path inside one of the roots.
+
+        Returns:
+            The device of the root containing path.
+        """
+        path = os.path.abspath(path)
+        for root in sorted(self._roots, key=lambda r: len(os.path.abspath(r)), reverse=True):
+            absolute_root = os.path.abspath(root)
+            if path == absolute_root or path.startswith(absolute_root.rstrip(os.sep) + os.sep):
+                return self._devices[root]
+        return get_device(path)
+
+    def all_works(self, groupings=None):
+        """
+        List every work in the library.
+
+        Args:
+            groupings: List of Grouping enums to list works for, None for all groupings.
+
+        Returns:
+            List of tuples of Grouping enum and name of the work as str.
+        """
+        if groupings is None:
+            groupings = list(self._grouping)
+        return [(grouping, work) for grouping in groupings for work in self.list_works(grouping)]
+
+    def schedule(self, fn, works, journal=None):
+        """
+        Run fn on every work, limiting concurrent calls on each device.
+
+        Args:
+            fn: Callable taking a Grouping enum, name of a work and any further items of the tuple.
+            works: List of tuples of Grouping enum, name of the work as str and any further arguments for fn.
+            journal: JobJournal to record the jobs in, None for no journal.
+                Jobs that already succeeded in the journal are skipped, and failed jobs are retried with backoff.
+                Jobs for which fn returns False are recorded as skipped and run again on resume.
+
+        Returns:
+            List of results in the same order as works.
+            With a journal, None for jobs that were skipped or failed instead of raising.
+        """
+        if journal is not None:
+            fn = self._journaled(fn, works, journal)
+        return self._scheduler.map(lambda w: fn(*w), works, lambda w: self.device_of(self.work_directory(w[0], w[1])))
+
+    def _journaled(self, fn, works, journal):
+        """
+        Wrap fn to record its calls in a journal, queueing every work that has not already succeeded.
+
+        Args:
+            fn: Callable taking a Grouping enum, name of a work and any further items of the tuple.
+            works: List of tuples of Grouping enum, name of the work as str and any further arguments for fn.
+            journal: JobJournal to record the jobs in.
+
+        Returns:
+            The wrapped callable.
+        """
+        def job_name(grouping, work, *args):
+            return "/".join([grouping.value, work, *[str(arg) for arg in args]])
+
+        for w in works:
+            previous = journal.get(job_name(*w))
+            if previous is None or previous["state"] != "succeeded":
+                journal.record(job_name(*w), "queued", attempt=previous["attempt"] if previous is not None else 0)
+
+        def run(*w):
+            job = job_name(*w)
+            previous = journal.get(job)
+            if previous["state"] == "succeeded":
+                return None
+            first_attempt = attempt = previous["attempt"]
+            while True:
+                if attempt > first_attempt:
+                    time.sleep(min(self._backoff * 2 ** (attempt - first_attempt - 1), self._max_backoff))
+                attempt += 1
+                journal.record(job, "running", attempt=attempt)
+                start = time.monotonic()
+                try:
+                    result = fn(*w)
+                except Exception as e:
+                    journal.record(job, "failed", attempt=attempt, duration=time.monotonic() - start, error="{0}: {1}".format(type(e).__name__, e))
+                    if attempt - first_attempt > self._retries:
+                        return None
+                    continue
+                journal.record(job, "skipped" if result is False else "succeeded", attempt=attempt, duration=time.monotonic() - start)
+                return result
+        return run
+
     def get_comic_epub_command(self, source, destination, cover, metadata):
         """
         Get the command for converting a comic to EPUB.
@@ -168,18 +396,22 @@ class Library:
             metadata: Metadata object for the work.
 
         Returns:
-            Nothing.
+            Path to the built EPUB.
         """
         title = os.path.basename(os.path.normpath(source))
         chapters = [os.path.join(source, chapter) for chapter in metadata.chapters]
 
         txt = generate_comic_table_of_contents(chapters, destination)
         cover = find_cover(source, self._covers)
-        cbc = generate_cbc(chapters, destination, txt, title)
-        command = self.get_comic_epub_command(cbc, "{0}.epub".format(os.path.splitext(cbc)[0]), cover, metadata)
-        subprocess.run(command)
-        os.remove(txt)
-        os.remove(cbc)
+        cbc = generate_cbc(chapters, destination, txt, title, **self._archive_options)
+        epub = "{0}.epub".format(os.path.splitext(cbc)[0])
+        command = self.get_comic_epub_command(cbc, epub, cover, metadata)
+        try:
+            self._converter.convert(command)
+        finally:
+            os.remove(txt)
+            os.remove(cbc)
+        return epub
     
     def build_text_epub(self, source, destination, metadata):
         """
@@ -191,37 +423,159 @@ class Library:
             metadata: Metadata object for the work.
 
         Returns:
-            Nothing.
+            Path to the built EPUB.
         """
         title = os.path.basename(os.path.normpath(source))
         chapters = [os.path.join(source, chapter) for chapter in metadata.chapters]
 
+        chapters = expand_text_chapters(chapters, os.path.join(destination, "chapters"), self._css_file)
         html = generate_text_table_of_contents(chapters, destination, title)
         cover = find_cover(source, self._covers)
-        command = self.get_text_epub_command(html, "{0}.epub".format(os.path.splitext(html)[0]), cover, metadata)
-        subprocess.run(command)
-        
-        os.remove(html)
+        epub = "{0}.epub".format(os.path.splitext(html)[0])
+        command = self.get_text_epub_command(html, epub, cover, metadata)
+        try:
+            self._converter.convert(command)
+        finally:
+            os.remove(html)
+        return epub
     
     def build_epub(self, grouping, work):
         """
         Build the EPUB for a given grouping and work.
 
+        The build runs in a private scratch directory while holding a lock for the work,
+        and the finished EPUB is moved into the output directory with an atomic rename.
+        In deterministic mode the EPUB is normalized first, with identifiers derived from the grouping and work.
+
         Args:
             grouping: Grouping enum representing the grouping of the work.
             work: Name of the work as str.
 
         Returns:
-            Nothing.
+            Bool whether the EPUB was built, False if skipped because the work is already being built.
+
+        Raises:
+            ValueError: If grouping is neither a comic nor a text grouping.
+            TimeoutError: If the work is still being built elsewhere after waiting for the lock timeout.
+            subprocess.CalledProcessError: If the conversion fails.
+            subprocess.TimeoutExpired: If the conversion takes longer than the Calibre timeout.
         """
-        metadata = self.load_metadata(grouping, work)
-        source = os.path.abspath(os.path.join(self._root_directory, grouping.value, work))
-        destination = os.path.abspath(os.path.join(self._root_directory, grouping.value, work, self._output_directory))
         if self.is_comic(grouping):
-            self.build_comic_epub(source, destination, metadata)
+            build = self.build_comic_epub
         elif self.is_text(grouping):
-            self.build_text_epub(source, destination, metadata)
+            build = self.build_text_epub
+        else:
+            raise ValueError("Unknown grouping: {0}".format(grouping.value))
+        metadata = self.load_metadata(grouping, work)
+        source = os.path.abspath(self.work_directory(grouping, work))
+        destination = os.path.abspath(os.path.join(source, self._output_directory))
+        if not os.path.exists(destination):
+            os.makedirs(destination)
+        with work_lock(os.path.join(destination, LOCK_FILE), wait=self._lock_policy != "skip", timeout=self._lock_timeout) as acquired:
+            if not acquired:
+                return False
+            clean_scratch(destination)
+            cover = find_cover(source, self._covers)
+            cover_hash = hash_file(cover) if cover is not None else None
+            scratch = make_scratch(destination, "build" if self._deterministic else None)
+            try:
+                epub = build(source, scratch, metadata)
+                if self._deterministic:
+                    normalize_epub(epub, "{0}/{1}".format(grouping.value, work))
+                os.replace(epub, os.path.join(destination, os.path.basename(epub)))
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            self._save_cover_hash(destination, cover_hash)
+        return True
+
+    def _load_cover_hash(self, destination):
+        """
+        Load the hash of the cover the EPUB in an output directory was last built or updated with.
+
+        Args:
+            destination: Path to the output directory of a work.
+
+        Returns:
+            SHA-256 hex digest of the cover as str, None if unknown.
+        """
+        try:
+            with open(os.path.join(destination, COVER_HASH_FILE), "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _save_cover_hash(self, destination, cover_hash):
+        """
+        Save the hash of the cover the EPUB in an output directory was built or updated with.
+
+        Args:
+            destination: Path to the output directory of a work.
+            cover_hash: SHA-256 hex digest of the cover as str, None if the EPUB has no cover.
+
+        Returns:
+            Nothing.
+        """
+        path = os.path.join(destination, COVER_HASH_FILE)
+        if cover_hash is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path, "w") as f:
+            f.write(cover_hash)
     
+    def apply_metadata(self, grouping, work):
+        """
+        Apply the metadata and cover of a given grouping and work to its existing EPUB without a full rebuild.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work: Name of the work as str.
+
+        Returns:
+            Bool whether the metadata was applied, False if skipped because the work is being built.
+
+        Raises:
+            FileNotFoundError: If no EPUB file can be found.
+            TimeoutError: If the work is still being built elsewhere after waiting for the lock timeout.
+        """
+        source = os.path.abspath(self.work_directory(grouping, work))
+        destination = os.path.join(source, self._output_directory)
+        epub = os.path.join(destination, "{0}.epub".format(work))
+        if not os.path.isfile(epub):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), epub)
+        with work_lock(os.path.join(destination, LOCK_FILE), wait=self._lock_policy != "skip", timeout=self._lock_timeout) as acquired:
+            if not acquired:
+                return False
+            # Calibre re-encodes the cover it embeds, so compare against the hash of the cover the EPUB was made with.
+            cover = find_cover(source, self._covers)
+            cover_hash = hash_file(cover) if cover is not None else None
+            if cover_hash is not None and cover_hash == self._load_cover_hash(destination):
+                cover = None
+            replaced = update_epub_metadata(epub, self.load_metadata(grouping, work), cover)
+            if self._deterministic:
+                normalize_epub(epub, "{0}/{1}".format(grouping.value, work))
+            if replaced:
+                self._save_cover_hash(destination, cover_hash)
+        return True
+
+    def apply_metadata_all(self, works):
+        """
+        Apply metadata to the existing EPUBs of many works, limiting concurrent updates on each device.
+        Works without an EPUB are skipped.
+
+        Args:
+            works: List of tuples of Grouping enum and name of the work as str.
+
+        Returns:
+            List of bools whether the metadata was applied to each work, in the same order as works.
+        """
+        def apply(grouping, work):
+            try:
+                return self.apply_metadata(grouping, work)
+            except FileNotFoundError:
+                return False
+        return self.schedule(apply, works)
+
     def open_epub(self, grouping, work):
         """
         Open the EPUB for a given grouping and work.
@@ -236,7 +590,7 @@ class Library:
         Raises:
             FileNotFoundError: If no EPUB file can be found.
         """
-        folder = os.path.abspath(os.path.join(self._root_directory, grouping.value, work, self._output_directory))
+        folder = os.path.abspath(os.path.join(self.work_directory(grouping, work), self._output_directory))
         epub = os.path.join(folder, "{0}.epub".format(work))
         if os.path.isfile(epub):
             command = self.get_view_epub_command(epub)
@@ -255,10 +609,24 @@ class Library:
         Returns:
             Nothing.
         """
-        location = os.path.join(self._root_directory, grouping.value, work)
+        location = self.work_directory(grouping, work)
         if not os.path.exists(location):
             os.makedirs(location)
     
+    def build_epubs(self, works, journal=None):
+        """
+        Build the EPUBs for many works, limiting concurrent builds on each device.
+
+        Args:
+            works: List of tuples of Grouping enum and name of the work as str.
+            journal: JobJournal to record the builds in, None for no journal.
+
+        Returns:
+            List of bools whether each EPUB was built, in the same order as works.
+            With a journal, None for builds that were skipped or failed.
+        """
+        return self.schedule(self.build_epub, works, journal)
+
     def import_chapters(self, grouping, work, chapters):
         """
         Imports chapters for a given grouping and work.
@@ -271,12 +639,89 @@ class Library:
         Returns:
             Nothing.
         """
-        destination = os.path.abspath(os.path.join(self._root_directory, grouping.value, work))
+        destination = os.path.abspath(self.work_directory(grouping, work))
         if self.is_comic(grouping):
-            import_comics(chapters, destination)
+            import_comics(chapters, destination, **self._archive_options)
         elif self.is_text(grouping):
-            import_texts(chapters, destination, self._css_file)
+            import_texts(chapters, destination, self._css_file, self._text_compression)
     
+    def import_works(self, imports, journal=None):
+        """
+        Import chapters for many works, limiting concurrent imports on each device.
+        Each chapter is imported as a separate job.
+
+        Args:
+            imports: List of tuples of Grouping enum, name of the work as str and list of paths to the chapters to import.
+            journal: JobJournal to record the imports in, None for no journal.
+
+        Returns:
+            Nothing.
+        """
+        chapters = [(grouping, work, source) for grouping, work, sources in imports for source in sources]
+        self.schedule(lambda grouping, work, source: self.import_chapters(grouping, work, [source]), chapters, journal)
+
+    def list_works(self, grouping):
+        """
+        List the works in a given grouping across every root.
+
+        Args:
+            grouping: Grouping enum representing the grouping.
+
+        Returns:
+            List[str]: Names of the works in sorted order.
+        """
+        works = set()
+        for root in self._roots:
+            grouping_directory = os.path.join(root, grouping.value)
+            if os.path.isdir(grouping_directory):
+                with os.scandir(grouping_directory) as it:
+                    works.update(entry.name for entry in it if entry.is_dir())
+        return sorted(works)
+
+    def get_thumbnail_source(self, grouping, work):
+        """
+        Get the file to make the thumbnail for a given grouping and work from.
+        This is the cover if there is one, otherwise for comics the first chapter.
+        Only the metadata is read, so this is cheap enough to check a thumbnail cache with.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work: Name of the work as str.
+
+        Returns:
+            Path to the image or archive, None if there is no file to use.
+        """
+        work_directory = self.work_directory(grouping, work)
+        cover = find_cover(work_directory, self._covers)
+        if cover is not None:
+            return cover
+        if self.is_comic(grouping):
+            chapters = self.load_metadata(grouping, work).chapters
+            if chapters:
+                return os.path.abspath(os.path.join(work_directory, chapters[0]))
+        return None
+
+    def get_thumbnail_page(self, source):
+        """
+        Get the image inside a thumbnail source to make the thumbnail from.
+
+        Args:
+            source: Path from get_thumbnail_source.
+
+        Returns:
+            Name of the first page if source is a .cbz archive, otherwise None.
+
+        Raises:
+            FileNotFoundError: If source is an archive without any images.
+        """
+        if not source.endswith(".cbz"):
+            return None
+        with ZipFile(source, "r") as z:
+            pages = sorted(name for name in z.namelist() if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        if not pages:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), source)
+        return pages[0]
+
     def load_metadata(self, grouping, work):
         """
         Load metadata for a given grouping and work.
@@ -288,7 +733,7 @@ class Library:
         Returns:
             Metadata: The metadata.
         """
-        work_directory = os.path.join(self._root_directory, grouping.value, work)
+        work_directory = self.work_directory(grouping, work)
         metadata_json_file = os.path.abspath(os.path.join(work_directory, "metadata.json"))
         if os.path.isfile(metadata_json_file):
             with open(metadata_json_file, "r") as f:
@@ -303,7 +748,7 @@ class Library:
             elif self.is_text(grouping):
                 with os.scandir(work_directory) as it:
                     for entry in sorted(it, key=lambda e: e.name):
-                        if entry.is_file() and entry.name.endswith(".html"):
+                        if entry.is_file() and is_text_chapter(entry.name):
                             chapters.append(entry.name)
             return Metadata(chapters=chapters)
     
@@ -319,26 +764,233 @@ class Library:
         Returns:
             Nothing.
         """
-        metadata_json_file = os.path.abspath(os.path.join(self._root_directory, grouping.value, work, "metadata.json"))
+        metadata_json_file = os.path.abspath(os.path.join(self.work_directory(grouping, work), "metadata.json"))
         with open(metadata_json_file, "w") as f:
             f.write(metadata.to_json())
     
-    def regenerate(self):
+    def regenerate(self, journal=None):
         """
         Regenerate library absolute paths.
 
         Args:
-            None
+            journal: JobJournal to record the work in, None for no journal.
         Returns:
             Nothing        
         """
-        for text_grouping in self._texts:
-            text_grouping_dir = os.path.join(self._root_directory, text_grouping)
-            with os.scandir(text_grouping_dir) as it:
-                for entry in it:
-                    if entry.is_dir():
-                        text_work_dir = os.path.join(text_grouping_dir, entry.name)
-                        with os.scandir(text_work_dir) as it:
-                            for entry in it:
-                                if entry.name.endswith(".html"):
-                                    fix_css(entry.path, self._css_file)
\ No newline at end of file
+        self.schedule(self.regenerate_work, self.all_works([self._grouping(text_grouping) for text_grouping in self._texts]), journal)
+
+    def regenerate_work(self, grouping, work):
+        """
+        Regenerate absolute paths for a given grouping and work.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work: Name of the work as str.
+
+        Returns:
+            Nothing.
+        """
+        with os.scandir(self.work_directory(grouping, work)) as it:
+            for entry in it:
+                if is_text_chapter(entry.name):
+                    fix_css(entry.path, self._css_file)
+
+    def migrate_texts(self, compression):
+        """
+        Convert the chapters of every text work to a given compression, limiting concurrent conversions on each device.
+        Chapter names in existing metadata.json files are updated to match, including when some conversions fail.
+
+        Args:
+            compression: Compression as one of the keys of TEXT_CHAPTER_EXTENSIONS, None for plain .html files.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            Exception: The first error from a failed conversion, after every other conversion has finished.
+        """
+        jobs = []
+        for grouping in self._grouping:
+            if not self.is_text(grouping):
+                continue
+            for work in self.list_works(grouping):
+                work_directory = self.work_directory(grouping, work)
+                with os.scandir(work_directory) as it:
+                    for entry in it:
+                        if entry.is_file() and is_text_chapter(entry.name) and get_text_chapter_compression(entry.name) != compression:
+                            jobs.append((grouping, work, entry.path))
+
+        def recompress(job):
+            try:
+                return recompress_text_chapter(job[2], compression), None
+            except Exception as e:
+                return None, e
+
+        results = self._scheduler.map(recompress, jobs, lambda job: self.device_of(job[2]))
+
+        # Record every chapter that was converted before raising, since the originals are already gone.
+        renamed = {}
+        for (grouping, work, old), (new, error) in zip(jobs, results):
+            if error is None:
+                renamed.setdefault((grouping, work), {})[os.path.basename(old)] = os.path.basename(new)
+        for (grouping, work), names in renamed.items():
+            if os.path.isfile(os.path.join(self.work_directory(grouping, work), "metadata.json")):
+                metadata = self.load_metadata(grouping, work)
+                if metadata.chapters:
+                    metadata.chapters = [names.get(chapter, chapter) for chapter in metadata.chapters]
+                    self.save_metadata(grouping, work, metadata)
+        errors = [error for new, error in results if error is not None]
+        if errors:
+            raise errors[0]
+
+    def get_sync_path(self, grouping, work):
+        """
+        Get where the EPUB of a given grouping and work goes on a sync target.
+        EPUBs are laid out as Grouping/Series/Index - Title.epub, or Grouping/Title.epub for works not in a series.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work: Name of the work as str.
+
+        Returns:
+            Path relative to the sync target with / separators.
+        """
+        metadata = self.load_metadata(grouping, work)
+        title = metadata.title or work
+        if metadata.series:
+            if metadata.series_index:
+                title = "{0} - {1}".format(metadata.series_index, title)
+            parts = [grouping.value, metadata.series, title]
+        else:
+            parts = [grouping.value, title]
+        return "/".join(sanitize_filename(part) for part in parts) + ".epub"
+
+    def sync(self, target, delete=True):
+        """
+        Sync the built EPUBs of every work to a target directory, copying only new or changed EPUBs.
+
+        Args:
+            target: Name of a target in config["sync"]["targets"] or path to a directory.
+            delete: Whether to remove EPUBs from the target that are no longer in the library.
+
+        Returns:
+            Dict with the number of EPUBs "copied", "unchanged" and "removed".
+        """
+        target = self._sync_targets.get(target, target)
+        works = self.all_works()
+        epubs = [os.path.join(self.work_directory(grouping, work), self._output_directory, "{0}.epub".format(work)) for grouping, work in works]
+        paths = self.schedule(lambda grouping, work, epub: self.get_sync_path(grouping, work) if os.path.isfile(epub) else None, [(grouping, work, epub) for (grouping, work), epub in zip(works, epubs)])
+        files = {}
+        for (grouping, work), epub, path in zip(works, epubs, paths):
+            if path is None:
+                continue
+            if path in files:
+                path = "{0} ({1}).epub".format(path[:-len(".epub")], sanitize_filename(work))
+            files[path] = epub
+        return sync_files(files, target, self._sync_workers, delete)
+
+    def _chapter_files(self, grouping, work_directory):
+        """
+        List the chapter files in a work directory with a single directory scan.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work_directory: Path to the directory of the work.
+
+        Returns:
+            Dict of chapter file name to a list of its modification time in nanoseconds and size in bytes.
+        """
+        chapters = {}
+        with os.scandir(work_directory) as it:
+            for entry in it:
+                if entry.is_file() and ((self.is_comic(grouping) and entry.name.endswith(".cbz")) or (self.is_text(grouping) and is_text_chapter(entry.name))):
+                    stat = entry.stat()
+                    chapters[entry.name] = [stat.st_mtime_ns, stat.st_size]
+        return chapters
+
+    def scan_work(self, grouping, work):
+        """
+        Scan a given grouping and work for the library report.
+
+        Args:
+            grouping: Grouping enum representing the grouping of the work.
+            work: Name of the work as str.
+
+        Returns:
+            Dict with the "grouping" and "work", number of "chapters", total "bytes" on disk, whether it has a "cover",
+            modification time of the "epub" or None if not built, modification time of the "newest_chapter",
+            whether the EPUB is "stale" because a chapter is newer, "unlisted_chapters" on disk but not in metadata.json,
+            "missing_chapters" in the metadata but not on disk and the "error" that stopped the scan, which is None here.
+        """
+        work_directory = self.work_directory(grouping, work)
+        metadata = self.load_metadata(grouping, work)
+        chapters = metadata.chapters or []
+
+        on_disk = self._chapter_files(grouping, work_directory)
+
+        epub = os.path.join(work_directory, self._output_directory, "{0}.epub".format(work))
+        epub_mtime = os.path.getmtime(epub) if os.path.isfile(epub) else None
+        newest_chapter = max([on_disk[chapter][0] / 1e9 for chapter in chapters if chapter in on_disk], default=None)
+
+        return {
+            "grouping": grouping.value,
+            "work": work,
+            "chapters": len(chapters),
+            "bytes": directory_size(work_directory),
+            "cover": find_cover(work_directory, self._covers) is not None,
+            "epub": epub_mtime,
+            "newest_chapter": newest_chapter,
+            "stale": epub_mtime is not None and newest_chapter is not None and newest_chapter > epub_mtime,
+            "unlisted_chapters": sorted(set(on_disk) - set(chapters)) if os.path.isfile(os.path.join(work_directory, "metadata.json")) else [],
+            "missing_chapters": [chapter for chapter in chapters if chapter not in on_disk],
+            "error": None,
+        }
+
+    def report(self, use_cache=True):
+        """
+        Scan every work for the library report, limiting concurrent scans on each device.
+        Works whose directory, output directory, metadata.json and chapter files are unchanged since the last report are not rescanned.
+        Checking this only takes a scan of the work directory, which also notices chapters rewritten in place.
+
+        Args:
+            use_cache: Whether to use and update the report cache.
+
+        Returns:
+            List of dicts from scan_work. Works that could not be scanned, for example because of a malformed metadata.json,
+            get a row with zeroed counts and the "error" as str, which is never cached.
+        """
+        cache = ReportCache(self._report_cache) if use_cache else None
+
+        def scan(grouping, work):
+            try:
+                work_directory = os.path.abspath(self.work_directory(grouping, work))
+                signature = directory_signature([work_directory, os.path.join(work_directory, self._output_directory), os.path.join(work_directory, "metadata.json")])
+                signature.append(sorted([name, *stat] for name, stat in self._chapter_files(grouping, work_directory).items()))
+                if cache is not None:
+                    result = cache.get(work_directory, signature)
+                    if result is not None:
+                        return result
+                result = self.scan_work(grouping, work)
+            except Exception as e:
+                return {
+                    "grouping": grouping.value,
+                    "work": work,
+                    "chapters": 0,
+                    "bytes": 0,
+                    "cover": False,
+                    "epub": None,
+                    "newest_chapter": None,
+                    "stale": False,
+                    "unlisted_chapters": [],
+                    "missing_chapters": [],
+                    "error": "{0}: {1}".format(type(e).__name__, e),
+                }
+            if cache is not None:
+                cache.put(work_directory, signature, result)
+            return result
+
+        works = self.all_works()
+        rows = self.schedule(scan, works)
+        if cache is not None:
+            cache.save([os.path.abspath(self.work_directory(grouping, work)) for grouping, work in works])
+        return rows
\ No newline at end of file
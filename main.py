@@ -1,14 +1,149 @@
-from gui import *
+from library import *
+from report import format_table
+import argparse
+import json
+import os
 import sys
 
-def main():
-    library = Library("config.json")
+def run_gui(library):
+    from gui import Builder, QApplication
 
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1])
     gallery = Builder(library)
     gallery.resize(800, 600)
     gallery.show()
     sys.exit(app.exec_())
 
+def parse_work(parser, library, work):
+    """
+    Parse a work given on the command line, exiting with a usage error if it is invalid.
+
+    Args:
+        parser: The ArgumentParser to report errors with.
+        library: The Library the work is in.
+        work: Work as "Grouping/Work" where Grouping is the folder title of the grouping.
+
+    Returns:
+        Tuple of Grouping enum and name of the work as str.
+    """
+    grouping, _, name = work.replace("\\", "/").partition("/")
+    if not name:
+        parser.error("invalid work {0!r}, expected Grouping/Work".format(work))
+    if grouping not in library.all_groupings:
+        parser.error("invalid work {0!r}, grouping must be one of: {1}".format(work, ", ".join(library.all_groupings)))
+    return library.grouping(grouping), name
+
+def add_journal_arguments(parser):
+    """
+    Add the arguments for journaling a batch operation to a parser.
+
+    Args:
+        parser: The ArgumentParser of the batch operation.
+
+    Returns:
+        Nothing.
+    """
+    parser.add_argument("--journal", default=None, help="path to the job journal, defaults to the command name in the journal directory")
+    parser.add_argument("--resume", action="store_true", help="skip jobs that succeeded in the journal and retry failed ones")
+
+def open_journal(library, args):
+    """
+    Open the journal of a batch operation.
+
+    Args:
+        library: The Library the operation runs on.
+        args: The parsed command line arguments.
+
+    Returns:
+        JobJournal for the operation.
+    """
+    return JobJournal(args.journal or os.path.join(library.journal_directory, "{0}.jsonl".format(args.command)), args.resume)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the chapters of works and build EPUBs from them. Opens the GUI when no command is given.")
+    parser.add_argument("--config", default="config.json", help="path to the json configuration file")
+    subparsers = parser.add_subparsers(dest="command")
+
+    build_parser = subparsers.add_parser("build", help="build the EPUBs of works")
+    build_parser.add_argument("works", nargs="*", help="works to build as Grouping/Work, every work if none are given")
+    add_journal_arguments(build_parser)
+
+    apply_metadata_parser = subparsers.add_parser("apply-metadata", help="apply metadata.json and cover changes to existing EPUBs without rebuilding them")
+    apply_metadata_parser.add_argument("works", nargs="*", help="works to update as Grouping/Work, every work if none are given")
+
+    import_parser = subparsers.add_parser("import", help="import chapters into a work")
+    import_parser.add_argument("work", help="work to import into as Grouping/Work")
+    import_parser.add_argument("chapters", nargs="+", help="paths to the chapters to import")
+    add_journal_arguments(import_parser)
+
+    regenerate_parser = subparsers.add_parser("regenerate", help="regenerate library absolute paths")
+    add_journal_arguments(regenerate_parser)
+
+    sync_parser = subparsers.add_parser("sync", help="copy new or changed EPUBs to an e-reader or mirror directory")
+    sync_parser.add_argument("target", help="name of a target in the config or path to a directory")
+    sync_parser.add_argument("--keep", action="store_true", help="keep EPUBs on the target that are no longer in the library")
+
+    report_parser = subparsers.add_parser("report", help="report the health and disk usage of every work")
+    report_parser.add_argument("--json", action="store_true", help="output JSON instead of a table")
+    report_parser.add_argument("--sort", choices=["name", "bytes", "chapters"], default="name", help="order of the works")
+    report_parser.add_argument("--problems", action="store_true", help="only list works that could not be scanned, are stale, unbuilt, without a cover or with chapters missing from or not in metadata.json")
+    report_parser.add_argument("--no-cache", action="store_true", help="rescan every work")
+
+    summary_parser = subparsers.add_parser("summary", help="summarize the slowest and failing jobs of the last batch operation")
+    summary_parser.add_argument("operation", choices=["build", "import", "regenerate"])
+    summary_parser.add_argument("--journal", default=None, help="path to the job journal, defaults to the operation name in the journal directory")
+    summary_parser.add_argument("--count", type=int, default=10, help="number of slowest jobs to list")
+
+    migrate_texts_parser = subparsers.add_parser("migrate-texts", help="convert the chapters of every text work to a storage mode")
+    migrate_texts_parser.add_argument("compression", choices=["none", *[k for k in TEXT_CHAPTER_EXTENSIONS if k]])
+
+    args = parser.parse_args()
+    library = Library(args.config)
+    journal = None
+
+    if args.command is None:
+        run_gui(library)
+    elif args.command == "build":
+        works = [parse_work(parser, library, work) for work in args.works] or library.all_works()
+        journal = open_journal(library, args)
+        library.build_epubs(works, journal)
+        print(journal.summary())
+    elif args.command == "apply-metadata":
+        works = [parse_work(parser, library, work) for work in args.works] or library.all_works()
+        library.apply_metadata_all(works)
+    elif args.command == "import":
+        grouping, work = parse_work(parser, library, args.work)
+        library.create_work(grouping, work)
+        journal = open_journal(library, args)
+        library.import_works([(grouping, work, [os.path.abspath(chapter) for chapter in args.chapters])], journal)
+        print(journal.summary())
+    elif args.command == "regenerate":
+        journal = open_journal(library, args)
+        library.regenerate(journal)
+        print(journal.summary())
+    elif args.command == "sync":
+        counts = library.sync(args.target, delete=not args.keep)
+        print("{0} copied, {1} unchanged, {2} removed".format(counts["copied"], counts["unchanged"], counts["removed"]))
+    elif args.command == "report":
+        rows = library.report(use_cache=not args.no_cache)
+        if args.problems:
+            rows = [row for row in rows if row.get("error") or row["stale"] or row["epub"] is None or not row["cover"] or row["unlisted_chapters"] or row["missing_chapters"]]
+        if args.sort == "bytes":
+            rows.sort(key=lambda row: row["bytes"], reverse=True)
+        elif args.sort == "chapters":
+            rows.sort(key=lambda row: row["chapters"], reverse=True)
+        if args.json:
+            print(json.dumps(rows, indent=4))
+        else:
+            print(format_table(rows))
+    elif args.command == "summary":
+        journal = JobJournal(args.journal or os.path.join(library.journal_directory, "{0}.jsonl".format(args.operation)), resume=True)
+        print(journal.summary(args.count))
+    elif args.command == "migrate-texts":
+        library.migrate_texts(None if args.compression == "none" else args.compression)
+    library.close()
+    if journal is not None and journal.failed():
+        sys.exit(1)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,161 @@
+import json
+import os
+import os.path
+import threading
+
+def directory_size(directory):
+    """
+    Get the total size of the files in a directory and its subdirectories.
+
+    Args:
+        directory: Path to the directory.
+
+    Returns:
+        Total size in bytes.
+    """
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+def directory_signature(paths):
+    """
+    Get a signature that changes whenever files are added, removed or renamed in any of the given paths.
+    Files inside directories that are edited in place without being replaced do not change it.
+
+    Args:
+        paths: List of paths to directories or files.
+
+    Returns:
+        List of modification times in nanoseconds, None for paths that do not exist.
+    """
+    signature = []
+    for path in paths:
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+def format_size(size):
+    """
+    Format a size in bytes for people to read.
+
+    Args:
+        size: Size in bytes.
+
+    Returns:
+        The formatted size as str.
+    """
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024 or unit == "GiB":
+            return "{0:.1f} {1}".format(size, unit) if unit != "B" else "{0} B".format(size)
+        size /= 1024
+
+def format_table(rows):
+    """
+    Format library report rows as a table.
+
+    Args:
+        rows: List of dicts from Library.scan_work.
+
+    Returns:
+        The table as str.
+    """
+    header = ["Work", "Chapters", "Size", "Cover", "EPUB", "Not in metadata", "Missing", "Error"]
+    lines = [[
+        "{0}/{1}".format(row["grouping"], row["work"]),
+        str(row["chapters"]),
+        format_size(row["bytes"]),
+        "yes" if row["cover"] else "no",
+        "missing" if row["epub"] is None else "stale" if row["stale"] else "ok",
+        str(len(row["unlisted_chapters"])),
+        str(len(row["missing_chapters"])),
+        row.get("error") or "",
+    ] for row in rows]
+    widths = [max(len(line[i]) for line in [header, *lines]) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in [header, *lines])
+
+class ReportCache:
+    """
+    An on-disk cache of per-work report results, keyed by work directory and invalidated by directory_signature.
+
+    Attributes:
+        _path: Path to the cache file.
+        _entries: Dict of work directory to a dict with its "signature" and "result".
+        _lock: Lock guarding _entries.
+    """
+    def __init__(self, path):
+        """
+        Initialize ReportCache class with given cache file.
+
+        Args:
+            path: Path to the cache file.
+
+        Returns:
+            Nothing.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    def get(self, key, signature):
+        """
+        Get a cached result if its signature still matches.
+
+        Args:
+            key: Work directory as str.
+            signature: Current signature from directory_signature.
+
+        Returns:
+            The cached result, None if missing or out of date.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry["signature"] != signature:
+            return None
+        return entry["result"]
+
+    def put(self, key, signature, result):
+        """
+        Cache a result.
+
+        Args:
+            key: Work directory as str.
+            signature: Signature from directory_signature when result was computed.
+            result: The result, which must be JSON serializable.
+
+        Returns:
+            Nothing.
+        """
+        with self._lock:
+            self._entries[key] = {"signature": signature, "result": result}
+
+    def save(self, keys=None):
+        """
+        Atomically save the cache.
+
+        Args:
+            keys: Work directories to keep, None to keep every entry.
+
+        Returns:
+            Nothing.
+        """
+        with self._lock:
+            if keys is not None:
+                self._entries = {key: self._entries[key] for key in keys if key in self._entries}
+            entries = dict(self._entries)
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open("{0}.tmp".format(self._path), "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace("{0}.tmp".format(self._path), self._path)
@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class DeviceScheduler:
+    """
+    Runs jobs with a separate concurrency limit for each device.
+
+    Each device gets its own thread pool, so jobs waiting on a busy device never hold up jobs for another device.
+
+    Attributes:
+        _limits: Dict of device to the maximum number of concurrent jobs on it.
+        _default_limit: Maximum number of concurrent jobs on devices not in _limits.
+        _executors: Dict of device to its ThreadPoolExecutor, created when first used.
+        _lock: Lock guarding _executors.
+    """
+    def __init__(self, limits, default_limit):
+        """
+        Initialize DeviceScheduler class with given concurrency limits.
+
+        Args:
+            limits: Dict of device to the maximum number of concurrent jobs on it.
+            default_limit: Maximum number of concurrent jobs on devices not in limits.
+
+        Returns:
+            Nothing.
+        """
+        self._limits = limits
+        self._default_limit = default_limit
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def submit(self, device, fn, *args, **kwargs):
+        """
+        Schedule a job on a given device.
+
+        Args:
+            device: The device the job does I/O on.
+            fn: Callable to run.
+            *args: Positional arguments for fn.
+            **kwargs: Keyword arguments for fn.
+
+        Returns:
+            Future for the result of the job.
+        """
+        with self._lock:
+            if device not in self._executors:
+                self._executors[device] = ThreadPoolExecutor(max_workers=self._limits.get(device, self._default_limit))
+            executor = self._executors[device]
+        return executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, items, device_of):
+        """
+        Run fn on every item, scheduling each on the device it does I/O on.
+
+        Args:
+            fn: Callable taking a single item.
+            items: Iterable of items.
+            device_of: Callable returning the device for an item.
+
+        Returns:
+            List of results in the same order as items.
+        """
+        futures = [self.submit(device_of(item), fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """
+        Wait for all scheduled jobs and release the thread pools.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors = {}
+        for executor in executors:
+            executor.shutdown()
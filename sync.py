@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import os.path
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_FILE = ".epub-chapters-sync.json"
+
+def sanitize_filename(name):
+    """
+    Make a name safe to use as a file name on e-readers and FAT formatted devices.
+
+    Args:
+        name: The name as str.
+
+    Returns:
+        The sanitized name.
+    """
+    name = re.sub(r"[<>:\"/\\|?*\x00-\x1f]", "_", name).rstrip(". ")
+    return name or "_"
+
+def hash_file(path):
+    """
+    Hash the content of a file.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        SHA-256 hex digest of the file as str.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(target):
+    """
+    Load the manifest of what a sync target holds.
+
+    Args:
+        target: Path to the sync target directory.
+
+    Returns:
+        Dict of path relative to target to a dict with the hash, size and mtime of the source it was copied from.
+    """
+    try:
+        with open(os.path.join(target, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(target, manifest):
+    """
+    Atomically save the manifest of what a sync target holds.
+
+    Args:
+        target: Path to the sync target directory.
+        manifest: Dict from load_manifest.
+
+    Returns:
+        Nothing.
+    """
+    path = os.path.join(target, MANIFEST_FILE)
+    with open("{0}.tmp".format(path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace("{0}.tmp".format(path), path)
+
+def _copy(source, destination, stat):
+    """
+    Copy a file, placing it atomically and keeping its modification time.
+
+    Args:
+        source: Path to the file to copy.
+        destination: Path to copy to.
+        stat: os.stat_result of source.
+
+    Returns:
+        Nothing.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temporary = "{0}.tmp".format(destination)
+    try:
+        shutil.copyfile(source, temporary)
+        os.utime(temporary, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def _prune(target, relative):
+    """
+    Remove the empty directories left after removing a file from a sync target.
+
+    Args:
+        target: Path to the sync target directory.
+        relative: Path of the removed file relative to target.
+
+    Returns:
+        Nothing.
+    """
+    directory = os.path.dirname(relative)
+    while directory:
+        try:
+            os.rmdir(os.path.join(target, directory))
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+def sync_files(files, target, workers=4, delete=True):
+    """
+    Make a target directory hold exactly the given files, copying only what is new or changed.
+
+    A file is skipped without being read if its source size and modification time match the manifest
+    and the copy on the target still has the same size. Otherwise its content is hashed, and it is only
+    copied if the hash differs. Copies run in parallel and are placed atomically.
+
+    Args:
+        files: Dict of path relative to target to path of the source file.
+        target: Path to the sync target directory.
+        workers: Maximum number of files to copy at once.
+        delete: Whether to remove files this sync placed on the target earlier that are no longer in files.
+
+    Returns:
+        Dict with the number of files "copied", "unchanged" and "removed".
+    """
+    if not os.path.exists(target):
+        os.makedirs(target)
+    manifest = load_manifest(target)
+    new_manifest = {}
+    checks = []
+    for relative, source in files.items():
+        stat = os.stat(source)
+        entry = manifest.get(relative)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            try:
+                if os.path.getsize(os.path.join(target, relative)) == entry["size"]:
+                    new_manifest[relative] = entry
+                    continue
+            except FileNotFoundError:
+                pass
+        checks.append((relative, source, stat, entry))
+
+    def check(job):
+        relative, source, stat, entry = job
+        destination = os.path.join(target, relative)
+        digest = hash_file(source)
+        copied = True
+        if entry is not None and entry["hash"] == digest and os.path.isfile(destination) and os.path.getsize(destination) == stat.st_size:
+            copied = False
+        else:
+            _copy(source, destination, stat)
+        return relative, {"hash": digest, "size": stat.st_size, "mtime": stat.st_mtime_ns}, copied
+
+    copied = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for relative, entry, was_copied in executor.map(check, checks):
+            new_manifest[relative] = entry
+            copied += was_copied
+
+    removed = 0
+    for relative in manifest:
+        if relative in new_manifest:
+            continue
+        if not delete:
+            new_manifest[relative] = manifest[relative]
+            continue
+        try:
+            os.remove(os.path.join(target, relative))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        _prune(target, relative)
+
+    save_manifest(target, new_manifest)
+    return {"copied": copied, "unchanged": len(files) - copied, "removed": removed}
@@ -0,0 +1,35 @@
+import os
+from zipfile import *
+
+import pytest
+
+import utility
+from utility import write_archive
+
+def make_entries(tmp_path):
+    entries = []
+    for i in range(20):
+        name = "{0:02}.txt".format(i) if i % 2 else "{0:02}.jpg".format(i)
+        source = tmp_path / "source-{0}".format(name)
+        source.write_bytes(os.urandom(64) if name.endswith(".jpg") else ("page {0}\n".format(i) * 500).encode("utf-8"))
+        entries.append((str(source), name))
+    return entries
+
+@pytest.mark.parametrize("precompressed", [True, False])
+@pytest.mark.parametrize("compression", [None, "deflate"])
+def test_write_archive_reads_back(tmp_path, monkeypatch, precompressed, compression):
+    if precompressed and not utility.WRITE_PRECOMPRESSED:
+        pytest.skip("entries are not written precompressed on this Python version")
+    monkeypatch.setattr(utility, "WRITE_PRECOMPRESSED", precompressed)
+    entries = make_entries(tmp_path)
+    archive = str(tmp_path / "archive.cbz")
+    write_archive(archive, entries, compression=compression, workers=3)
+
+    with ZipFile(archive, "r") as archive_zip_file:
+        assert archive_zip_file.testzip() is None
+        assert archive_zip_file.namelist() == [arcname for source, arcname in entries]
+        for source, arcname in entries:
+            with open(source, "rb") as f:
+                assert archive_zip_file.read(arcname) == f.read()
+            expected = ZIP_DEFLATED if compression == "deflate" and arcname.endswith(".txt") else ZIP_STORED
+            assert archive_zip_file.getinfo(arcname).compress_type == expected
@@ -0,0 +1,43 @@
+import os.path
+import sys
+from zipfile import *
+
+from converters import *
+
+WORKER = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "converter_worker.py"), "--fake"]
+
+# Stands in for ebook-convert when a conversion falls back to running as its own process.
+PROGRAM = [sys.executable, "-c", "import sys; open(sys.argv[2], 'w').write('fallback')"]
+
+def test_pooled_converter_reuses_fake_worker(tmp_path):
+    converter = PooledConverter(PROGRAM, WORKER, size=1, timeout=60)
+    try:
+        for title in ["One", "Two"]:
+            destination = str(tmp_path / "{0}.epub".format(title))
+            converter.convert([*PROGRAM, "source.html", destination, "--title", title])
+            with ZipFile(destination, "r") as epub:
+                assert "<dc:title>{0}</dc:title>".format(title) in epub.read("content.opf").decode("utf-8")
+        assert converter._started == 1
+        assert converter._idle[0].jobs == 2
+    finally:
+        converter.close()
+
+def test_pooled_converter_falls_back_when_worker_writes_garbage(tmp_path):
+    worker = [sys.executable, "-c", "import sys; print('not a reply', flush=True); sys.stdin.read()"]
+    converter = PooledConverter(PROGRAM, worker, size=1, timeout=60)
+    try:
+        destination = tmp_path / "book.epub"
+        converter.convert([*PROGRAM, "source.html", str(destination)])
+        assert destination.read_text() == "fallback"
+    finally:
+        converter.close()
+
+def test_pooled_converter_falls_back_when_worker_cannot_start(tmp_path):
+    converter = PooledConverter(PROGRAM, [str(tmp_path / "missing-worker")], size=1, timeout=60)
+    try:
+        destination = tmp_path / "book.epub"
+        converter.convert([*PROGRAM, "source.html", str(destination)])
+        assert destination.read_text() == "fallback"
+        assert converter._broken
+    finally:
+        converter.close()
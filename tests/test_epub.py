@@ -0,0 +1,199 @@
+from xml.dom import minidom
+from zipfile import *
+
+import pytest
+
+from epub import *
+from metadata import Metadata
+
+CONTAINER = "<?xml version=\"1.0\"?>\n<container version=\"1.0\" xmlns=\"urn:oasis:names:tc:opendocument:xmlns:container\"><rootfiles><rootfile full-path=\"OEBPS/content.opf\" media-type=\"application/oebps-package+xml\"/></rootfiles></container>"
+
+OPF = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="uuid_id" version="2.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:title>Old Title</dc:title>
+    <dc:creator opf:role="aut" opf:file-as="Author, Old">Old Author</dc:creator>
+    <dc:contributor opf:role="bkp">calibre</dc:contributor>
+    <dc:contributor opf:role="edt">Editor</dc:contributor>
+    <dc:identifier id="uuid_id" opf:scheme="uuid">11111111-2222-3333-4444-555555555555</dc:identifier>
+    <dc:language>en</dc:language>
+    <dc:date>2000-01-01T00:00:00+00:00</dc:date>
+    <dc:date opf:event="modification">2001-01-01</dc:date>
+    <meta name="calibre:timestamp" content="2020-01-01T00:00:00+00:00"/>
+    <meta name="cover" content="cover"/>
+  </metadata>
+  <manifest>
+    <item id="cover" href="images/cover.jpeg" media-type="image/jpeg"/>
+    <item id="notcover" href="images/notcover.jpeg" media-type="image/jpeg"/>
+    <item id="titlepage" href="text/titlepage.xhtml" media-type="application/xhtml+xml"/>
+    <item id="chapter" href="text/chapter.xhtml" media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine>
+    <itemref idref="titlepage"/>
+    <itemref idref="chapter"/>
+  </spine>
+  <guide>
+    <reference type="cover" href="text/titlepage.xhtml" title="Cover"/>
+  </guide>
+</package>"""
+
+TITLEPAGE = b"<html xmlns:xlink=\"http://www.w3.org/1999/xlink\"><body><svg><image xlink:href=\"../images/cover.jpeg\"/></svg><p>cover.jpeg</p></body></html>"
+
+CHAPTER = b"<html><body><img src=\"../images/notcover.jpeg\"/><a data-href=\"../images/cover.jpeg\">cover.jpeg</a></body></html>"
+
+def make_epub(path, opf=OPF):
+    with ZipFile(str(path), "w", ZIP_DEFLATED) as epub:
+        epub.writestr("mimetype", "application/epub+zip", ZIP_STORED)
+        epub.writestr("META-INF/container.xml", CONTAINER)
+        epub.writestr("OEBPS/content.opf", opf)
+        epub.writestr("OEBPS/images/cover.jpeg", b"old cover")
+        epub.writestr("OEBPS/images/notcover.jpeg", b"not the cover")
+        epub.writestr("OEBPS/text/titlepage.xhtml", TITLEPAGE)
+        epub.writestr("OEBPS/text/chapter.xhtml", CHAPTER)
+    return str(path)
+
+def read_entries(path):
+    with ZipFile(path, "r") as epub:
+        return {name: epub.read(name) for name in epub.namelist()}
+
+def metadata_children(opf, tag_name):
+    document = minidom.parseString(opf)
+    metadata_element = document.getElementsByTagName("metadata")[0]
+    return [node for node in metadata_element.childNodes if node.nodeType == node.ELEMENT_NODE and node.tagName.split(":")[-1] == tag_name]
+
+def texts(opf, tag_name):
+    return [node.firstChild.data for node in metadata_children(opf, tag_name)]
+
+def calibre_meta(opf, name):
+    return [node.getAttribute("content") for node in metadata_children(opf, "meta") if node.getAttribute("name") == "calibre:{0}".format(name)]
+
+@pytest.mark.parametrize("field, value, check", [
+    ("title", "New Title", lambda opf: texts(opf, "title") == ["New Title"]),
+    ("authors", "A One & B Two", lambda opf: texts(opf, "creator") == ["A One", "B Two"]),
+    ("book_producer", "Producer", lambda opf: texts(opf, "contributor") == ["Editor", "Producer"]),
+    ("comments", "A description.", lambda opf: texts(opf, "description") == ["A description."]),
+    ("isbn", "9780000000000", lambda opf: texts(opf, "identifier") == ["11111111-2222-3333-4444-555555555555", "9780000000000"]),
+    ("language", "de", lambda opf: texts(opf, "language") == ["de"]),
+    ("pubdate", "2010-05-05", lambda opf: texts(opf, "date") == ["2001-01-01", "2010-05-05"]),
+    ("publisher", "Publisher", lambda opf: texts(opf, "publisher") == ["Publisher"]),
+    ("tags", "one, two,", lambda opf: texts(opf, "subject") == ["one", "two"]),
+    ("rating", "4", lambda opf: calibre_meta(opf, "rating") == ["8"]),
+    ("series", "Series", lambda opf: calibre_meta(opf, "series") == ["Series"]),
+    ("series_index", "3", lambda opf: calibre_meta(opf, "series_index") == ["3"]),
+    ("title_sort", "Title, New", lambda opf: calibre_meta(opf, "title_sort") == ["Title, New"]),
+])
+def test_apply_opf_metadata_sets_field(field, value, check):
+    opf = apply_opf_metadata(OPF.encode("utf-8"), Metadata(**{field: value}))
+    assert check(opf)
+    if field != "title":
+        assert texts(opf, "title") == ["Old Title"]
+
+def test_apply_opf_metadata_keeps_unset_fields():
+    opf = apply_opf_metadata(OPF.encode("utf-8"), Metadata())
+    assert texts(opf, "title") == ["Old Title"]
+    assert texts(opf, "creator") == ["Old Author"]
+    assert texts(opf, "language") == ["en"]
+    assert calibre_meta(opf, "timestamp") == ["2020-01-01T00:00:00+00:00"]
+
+def test_apply_opf_metadata_puts_author_sort_on_first_author_only():
+    opf = apply_opf_metadata(OPF.encode("utf-8"), Metadata(authors="A One & B Two", author_sort="One, A"))
+    creators = metadata_children(opf, "creator")
+    assert [creator.getAttribute("opf:file-as") for creator in creators] == ["One, A", ""]
+    assert [creator.getAttribute("opf:role") for creator in creators] == ["aut", "aut"]
+
+def test_apply_opf_metadata_sets_author_sort_on_existing_author():
+    opf = apply_opf_metadata(OPF.encode("utf-8"), Metadata(author_sort="Sort, New"))
+    assert [creator.getAttribute("opf:file-as") for creator in metadata_children(opf, "creator")] == ["Sort, New"]
+
+def test_update_epub_metadata_replaces_cover_with_new_type(tmp_path):
+    epub = make_epub(tmp_path / "book.epub")
+    before = read_entries(epub)
+    cover = tmp_path / "cover.png"
+    cover.write_bytes(b"new cover")
+
+    assert update_epub_metadata(epub, Metadata(title="New Title"), str(cover))
+
+    after = read_entries(epub)
+    assert "OEBPS/images/cover.jpeg" not in after
+    assert after["OEBPS/images/cover.png"] == b"new cover"
+    assert after["OEBPS/images/notcover.jpeg"] == b"not the cover"
+    assert after["OEBPS/text/titlepage.xhtml"] == TITLEPAGE.replace(b"xlink:href=\"../images/cover.jpeg\"", b"xlink:href=\"../images/cover.png\"")
+    assert after["OEBPS/text/chapter.xhtml"] == CHAPTER
+    for name in ["mimetype", "META-INF/container.xml"]:
+        assert after[name] == before[name]
+
+    opf = after["OEBPS/content.opf"]
+    items = {item.getAttribute("id"): item for item in minidom.parseString(opf).getElementsByTagName("item")}
+    assert items["cover"].getAttribute("href") == "images/cover.png"
+    assert items["cover"].getAttribute("media-type") == "image/png"
+    assert items["notcover"].getAttribute("href") == "images/notcover.jpeg"
+    assert texts(opf, "title") == ["New Title"]
+
+def test_update_epub_metadata_keeps_cover_when_none_given(tmp_path):
+    epub = make_epub(tmp_path / "book.epub")
+    before = read_entries(epub)
+
+    assert not update_epub_metadata(epub, Metadata(title="New Title"))
+
+    after = read_entries(epub)
+    assert sorted(after) == sorted(before)
+    for name in before:
+        if name != "OEBPS/content.opf":
+            assert after[name] == before[name]
+
+def test_update_epub_metadata_without_cover_item(tmp_path):
+    epub = make_epub(tmp_path / "book.epub", OPF.replace("<meta name=\"cover\" content=\"cover\"/>", ""))
+    cover = tmp_path / "cover.png"
+    cover.write_bytes(b"new cover")
+
+    assert not update_epub_metadata(epub, Metadata(), str(cover))
+    assert read_entries(epub)["OEBPS/images/cover.jpeg"] == b"old cover"
+
+def make_generated_epub(path, book_uuid, timestamp, date_time, reverse):
+    opf = OPF.replace("11111111-2222-3333-4444-555555555555", book_uuid).replace("2020-01-01T00:00:00+00:00", timestamp)
+    entries = [
+        ("META-INF/container.xml", CONTAINER),
+        ("OEBPS/content.opf", opf),
+        ("OEBPS/toc.ncx", "<ncx><head><meta name=\"dtb:uid\" content=\"{0}\"/></head></ncx>".format(book_uuid)),
+        ("OEBPS/images/cover.jpeg", b"cover"),
+        ("OEBPS/text/titlepage.xhtml", TITLEPAGE),
+        ("OEBPS/text/chapter.xhtml", CHAPTER),
+    ]
+    if reverse:
+        entries.reverse()
+    with ZipFile(str(path), "w", ZIP_DEFLATED) as epub:
+        epub.writestr(ZipInfo("mimetype", date_time), "application/epub+zip", ZIP_STORED)
+        for name, data in entries:
+            info = ZipInfo(name, date_time)
+            info.compress_type = ZIP_DEFLATED
+            info.external_attr = 0o600 << 16
+            epub.writestr(info, data)
+    return str(path)
+
+def test_normalize_epub_gives_identical_bytes_for_identical_inputs(tmp_path):
+    first = make_generated_epub(tmp_path / "first.epub", "0b4f7a3e-1c7e-4f0e-9a55-2f7c0f1b2c3d", "2024-03-01T10:00:00+00:00", (2024, 3, 1, 10, 0, 0), False)
+    second = make_generated_epub(tmp_path / "second.epub", "9d8c7b6a-5f4e-4d3c-8b2a-1f0e9d8c7b6a", "2025-07-15T22:30:00+00:00", (2025, 7, 15, 22, 30, 0), True)
+    with open(first, "rb") as f1, open(second, "rb") as f2:
+        assert f1.read() != f2.read()
+
+    normalize_epub(first, "Texts/Novel")
+    normalize_epub(second, "Texts/Novel")
+
+    with open(first, "rb") as f1, open(second, "rb") as f2:
+        assert f1.read() == f2.read()
+    entries = read_entries(first)
+    assert "0b4f7a3e-1c7e-4f0e-9a55-2f7c0f1b2c3d" not in entries["OEBPS/toc.ncx"].decode("utf-8")
+    assert calibre_meta(entries["OEBPS/content.opf"], "timestamp") == [DETERMINISTIC_TIMESTAMP]
+    with ZipFile(first, "r") as epub:
+        assert epub.namelist()[0] == "mimetype"
+        assert epub.getinfo("mimetype").compress_type == ZIP_STORED
+
+def test_normalize_epub_depends_on_identifier(tmp_path):
+    first = make_generated_epub(tmp_path / "first.epub", "0b4f7a3e-1c7e-4f0e-9a55-2f7c0f1b2c3d", DETERMINISTIC_TIMESTAMP, DETERMINISTIC_DATE_TIME, False)
+    second = make_generated_epub(tmp_path / "second.epub", "0b4f7a3e-1c7e-4f0e-9a55-2f7c0f1b2c3d", DETERMINISTIC_TIMESTAMP, DETERMINISTIC_DATE_TIME, False)
+
+    normalize_epub(first, "Texts/Novel")
+    normalize_epub(second, "Texts/Other")
+
+    with open(first, "rb") as f1, open(second, "rb") as f2:
+        assert f1.read() != f2.read()
@@ -0,0 +1,174 @@
+import json
+import os
+
+import pytest
+
+from library import *
+from report import format_table
+from test_epub import OPF, make_epub
+
+@pytest.fixture
+def library(tmp_path):
+    config = {
+        "FORMATS": {"Comic": {"COMICS": "Comics"}, "Text": {"TEXTS": "Texts"}},
+        "Calibre": {"convert": ["ebook-convert"], "convert-comic-epub": [], "convert-html-epub": [], "viewer": ["ebook-viewer"]},
+        "root": str(tmp_path / "Library"),
+        "output": "bin",
+        "CSS": str(tmp_path / "Library" / "calibre.css"),
+        "covers": ["cover.png", "cover.jpg"],
+        "batch": {"journal": str(tmp_path / "journals"), "retries": 0, "backoff": 5, "max_backoff": 60},
+        "report": {"cache": str(tmp_path / "report.json")},
+    }
+    os.makedirs(str(tmp_path / "Library" / "Texts"))
+    with open(str(tmp_path / "config.json"), "w") as f:
+        json.dump(config, f)
+    library = Library(str(tmp_path / "config.json"))
+    yield library
+    library.close()
+
+def make_work(library, work, opf=OPF):
+    grouping = library.grouping("Texts")
+    library.create_work(grouping, work)
+    output = os.path.join(library.work_directory(grouping, work), "bin")
+    os.makedirs(output)
+    make_epub(os.path.join(output, "{0}.epub".format(work)), opf)
+    with open(os.path.join(library.work_directory(grouping, work), "cover.png"), "wb") as f:
+        f.write(b"new cover")
+    return grouping, output
+
+def test_apply_metadata_records_cover_hash_once_embedded(library):
+    grouping, output = make_work(library, "Novel")
+
+    assert library.apply_metadata(grouping, "Novel")
+    assert os.path.isfile(os.path.join(output, COVER_HASH_FILE))
+
+def test_apply_metadata_records_no_cover_hash_without_cover_item(library):
+    grouping, output = make_work(library, "Novel", OPF.replace("<meta name=\"cover\" content=\"cover\"/>", ""))
+
+    assert library.apply_metadata(grouping, "Novel")
+    assert not os.path.exists(os.path.join(output, COVER_HASH_FILE))
+
+class StubJob:
+    def __init__(self, results):
+        self.results = dict(results)
+        self.calls = []
+
+    def __call__(self, grouping, work):
+        self.calls.append(work)
+        result = self.results[work]
+        if isinstance(result, list):
+            result = result.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    return sleeps
+
+def run_jobs(library, journal_path, job, resume=False):
+    journal = JobJournal(journal_path, resume)
+    works = [(library.grouping("Texts"), work) for work in sorted(job.results)]
+    return library.schedule(job, works, journal), journal
+
+def test_schedule_journals_and_resume_skips_succeeded_jobs(library, tmp_path, sleeps):
+    journal_path = str(tmp_path / "build.jsonl")
+    results, journal = run_jobs(library, journal_path, StubJob({"A": True, "B": True}))
+    assert results == [True, True]
+    assert [journal.get("Texts/{0}".format(work))["state"] for work in "AB"] == ["succeeded", "succeeded"]
+
+    job = StubJob({"A": True, "B": True})
+    results, journal = run_jobs(library, journal_path, job, resume=True)
+    assert job.calls == []
+    assert results == [None, None]
+    assert sleeps == []
+
+def test_schedule_journals_false_as_skipped_and_resume_runs_it_again(library, tmp_path, sleeps):
+    journal_path = str(tmp_path / "build.jsonl")
+    results, journal = run_jobs(library, journal_path, StubJob({"A": False}))
+    assert results == [False]
+    assert journal.get("Texts/A")["state"] == "skipped"
+    assert journal.failed() == []
+
+    job = StubJob({"A": True})
+    results, journal = run_jobs(library, journal_path, job, resume=True)
+    assert job.calls == ["A"]
+    assert journal.get("Texts/A")["state"] == "succeeded"
+
+def test_schedule_retries_failed_jobs_up_to_the_limit_with_backoff(library, tmp_path, sleeps):
+    library._retries = 2
+    job = StubJob({"A": [ValueError("one"), ValueError("two"), ValueError("three"), True], "B": [ValueError("once"), True]})
+    results, journal = run_jobs(library, str(tmp_path / "build.jsonl"), job)
+    assert results == [None, True]
+    assert job.calls.count("A") == 3
+    assert job.calls.count("B") == 2
+    record = journal.get("Texts/A")
+    assert (record["state"], record["attempt"], record["error"]) == ("failed", 3, "ValueError: three")
+    assert journal.failed() == ["Texts/A"]
+    assert sorted(sleeps) == [5, 5, 10]
+
+def test_schedule_caps_backoff(library, tmp_path, sleeps):
+    library._retries = 4
+    library._max_backoff = 12
+    job = StubJob({"A": [ValueError()] * 5})
+    run_jobs(library, str(tmp_path / "build.jsonl"), job)
+    assert sleeps == [5, 10, 12, 12]
+
+def test_resume_requeues_failed_jobs_without_waiting_first(library, tmp_path, sleeps):
+    journal_path = str(tmp_path / "build.jsonl")
+    run_jobs(library, journal_path, StubJob({"A": ValueError("broken")}))
+    assert sleeps == []
+
+    job = StubJob({"A": True})
+    results, journal = run_jobs(library, journal_path, job, resume=True)
+    assert results == [True]
+    assert sleeps == []
+    record = journal.get("Texts/A")
+    assert (record["state"], record["attempt"]) == ("succeeded", 2)
+
+def test_resume_ignores_partial_last_line(library, tmp_path, sleeps):
+    journal_path = str(tmp_path / "build.jsonl")
+    run_jobs(library, journal_path, StubJob({"A": True}))
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write("{\"job\": \"Texts/B\", \"sta")
+
+    job = StubJob({"A": True, "B": True})
+    results, journal = run_jobs(library, journal_path, job, resume=True)
+    assert job.calls == ["B"]
+    assert journal.get("Texts/B")["state"] == "succeeded"
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[-1].startswith("{")
+    parsed = []
+    for line in lines:
+        try:
+            parsed.append(json.loads(line))
+        except ValueError:
+            assert line == "{\"job\": \"Texts/B\", \"sta"
+    assert parsed[-1]["job"] == "Texts/B" and parsed[-1]["state"] == "succeeded"
+
+def test_report_lists_broken_works_without_caching_them(library, tmp_path):
+    texts = library.grouping("Texts")
+    for work, metadata in [("Good", "{\"chapters\": []}"), ("Unknown", "{\"subtitle\": \"x\"}"), ("Truncated", "{\"chap")]:
+        library.create_work(texts, work)
+        with open(os.path.join(library.work_directory(texts, work), "metadata.json"), "w") as f:
+            f.write(metadata)
+
+    rows = {row["work"]: row for row in library.report()}
+    assert rows["Good"]["error"] is None
+    assert rows["Unknown"]["error"].startswith("TypeError")
+    assert rows["Truncated"]["error"].startswith("JSONDecodeError")
+    assert (rows["Unknown"]["chapters"], rows["Unknown"]["bytes"]) == (0, 0)
+    assert "TypeError" in format_table(list(rows.values()))
+
+    with open(library._report_cache, "r") as f:
+        cached = json.load(f)
+    assert [os.path.basename(key) for key in cached] == ["Good"]
+
+    with open(os.path.join(library.work_directory(texts, "Truncated"), "metadata.json"), "w") as f:
+        f.write("{\"chapters\": []}")
+    rows = {row["work"]: row for row in library.report()}
+    assert rows["Truncated"]["error"] is None
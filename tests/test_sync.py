@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import sync
+from sync import *
+
+@pytest.fixture
+def hashed(monkeypatch):
+    hashed = []
+    def record(path):
+        hashed.append(path)
+        return hash_file(path)
+    monkeypatch.setattr(sync, "hash_file", record)
+    return hashed
+
+def make_sources(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    files = {}
+    for relative, content in [("Texts/Novel.epub", b"novel"), ("Comics/Series/1 - Comic.epub", b"comic")]:
+        path = source / relative.replace("/", "_")
+        path.write_bytes(content)
+        files[relative] = str(path)
+    return files
+
+def test_sync_files_copies_then_skips_unchanged_files_without_hashing(tmp_path, hashed):
+    files = make_sources(tmp_path)
+    target = str(tmp_path / "target")
+
+    assert sync_files(files, target) == {"copied": 2, "unchanged": 0, "removed": 0}
+    for relative, source in files.items():
+        with open(os.path.join(target, relative), "rb") as copy, open(source, "rb") as original:
+            assert copy.read() == original.read()
+    assert os.path.isfile(os.path.join(target, MANIFEST_FILE))
+
+    hashed.clear()
+    assert sync_files(files, target) == {"copied": 0, "unchanged": 2, "removed": 0}
+    assert hashed == []
+
+def test_sync_files_does_not_copy_when_hash_matches(tmp_path, hashed):
+    files = make_sources(tmp_path)
+    target = str(tmp_path / "target")
+    sync_files(files, target)
+    destination = os.path.join(target, "Texts/Novel.epub")
+    os.utime(destination, ns=(0, 0))
+
+    source = files["Texts/Novel.epub"]
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    hashed.clear()
+
+    assert sync_files(files, target) == {"copied": 0, "unchanged": 2, "removed": 0}
+    assert hashed == [source]
+    assert os.stat(destination).st_mtime_ns == 0
+    assert load_manifest(target)["Texts/Novel.epub"]["mtime"] == stat.st_mtime_ns + 10 ** 9
+
+def test_sync_files_copies_changed_content(tmp_path, hashed):
+    files = make_sources(tmp_path)
+    target = str(tmp_path / "target")
+    sync_files(files, target)
+
+    with open(files["Texts/Novel.epub"], "wb") as f:
+        f.write(b"novel, second edition")
+
+    assert sync_files(files, target) == {"copied": 1, "unchanged": 1, "removed": 0}
+    with open(os.path.join(target, "Texts/Novel.epub"), "rb") as f:
+        assert f.read() == b"novel, second edition"
+
+def test_sync_files_removes_files_that_left_the_library_and_prunes_directories(tmp_path):
+    files = make_sources(tmp_path)
+    target = str(tmp_path / "target")
+    (tmp_path / "target" / "Comics").mkdir(parents=True)
+    (tmp_path / "target" / "Comics" / "unrelated.epub").write_bytes(b"not synced")
+    sync_files(files, target)
+
+    del files["Comics/Series/1 - Comic.epub"]
+    assert sync_files(files, target) == {"copied": 0, "unchanged": 1, "removed": 1}
+    assert not os.path.exists(os.path.join(target, "Comics", "Series"))
+    assert os.path.isfile(os.path.join(target, "Comics", "unrelated.epub"))
+    assert "Comics/Series/1 - Comic.epub" not in load_manifest(target)
+
+def test_sync_files_keeps_files_that_left_the_library_without_delete(tmp_path):
+    files = make_sources(tmp_path)
+    target = str(tmp_path / "target")
+    sync_files(files, target)
+
+    del files["Comics/Series/1 - Comic.epub"]
+    assert sync_files(files, target, delete=False) == {"copied": 0, "unchanged": 1, "removed": 0}
+    assert os.path.isfile(os.path.join(target, "Comics/Series/1 - Comic.epub"))
+    assert "Comics/Series/1 - Comic.epub" in load_manifest(target)
+
+    assert sync_files(files, target) == {"copied": 0, "unchanged": 1, "removed": 1}
+    assert not os.path.exists(os.path.join(target, "Comics"))
@@ -0,0 +1,28 @@
+import gzip
+import os.path
+
+from utility import expand_text_chapters
+
+def write_chapter(path, body):
+    with gzip.open(str(path), "wt", encoding="utf-8") as f:
+        f.write("<html><head><link rel=\"stylesheet\" href=\"../calibre.css\"></head><body>{0}</body></html>".format(body))
+
+def test_expand_text_chapters_keeps_links_between_chapters_and_rebases_the_rest(tmp_path):
+    work = tmp_path / "Texts" / "Novel"
+    work.mkdir(parents=True)
+    (work / "Static.jpg").write_bytes(b"image")
+    write_chapter(work / "a.html.gz", "<a href=\"b.html#part\">next</a><a href=\"c%20d.html\">later</a><img src=\"Static.jpg\"><a href=\"#top\">top</a>")
+    write_chapter(work / "b.html.gz", "<a href=\"a.html\">back</a>")
+    write_chapter(work / "c d.html.gz", "")
+    destination = work / "bin" / ".scratch-build" / "chapters"
+
+    expanded = expand_text_chapters([str(work / "a.html.gz"), str(work / "b.html.gz"), str(work / "c d.html.gz")], str(destination), str(tmp_path / "calibre.css"))
+
+    assert expanded == [str(destination / "a.html"), str(destination / "b.html"), str(destination / "c d.html")]
+    a = (destination / "a.html").read_text(encoding="utf-8-sig")
+    assert "href=\"b.html#part\"" in a
+    assert "href=\"c%20d.html\"" in a
+    assert "href=\"#top\"" in a
+    assert "src=\"../../../Static.jpg\"" in a
+    assert os.path.isfile(os.path.join(str(destination), "../../../Static.jpg"))
+    assert "href=\"a.html\"" in (destination / "b.html").read_text(encoding="utf-8-sig")
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import os.path
+import threading
+
+class ThumbnailCache:
+    """
+    An on-disk cache of encoded thumbnails with least recently used eviction.
+
+    Thumbnails are keyed by the path, modification time and size of their source,
+    so a changed source gets a new key and its old thumbnail ages out of the cache.
+
+    Attributes:
+        _directory: Path to the directory holding the cached thumbnails.
+        _max_bytes: Maximum total size of the cached thumbnails in bytes.
+        _total_bytes: Current total size of the cached thumbnails in bytes.
+        _lock: Lock guarding _total_bytes and eviction across threads.
+    """
+    def __init__(self, directory, max_bytes):
+        """
+        Initialize ThumbnailCache class with given directory and size cap.
+
+        Args:
+            directory: Path to the directory holding the cached thumbnails, created if missing.
+            max_bytes: Maximum total size of the cached thumbnails in bytes.
+
+        Returns:
+            Nothing.
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._total_bytes = 0
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".png"):
+                    self._total_bytes += entry.stat().st_size
+
+    def key(self, source, member=None):
+        """
+        Get the cache key for a thumbnail source.
+
+        Args:
+            source: Path to the source file.
+            member: Name of the entry inside source if source is an archive, otherwise None.
+
+        Returns:
+            The cache key as str.
+        """
+        stat = os.stat(source)
+        identity = "\0".join([os.path.abspath(source), member or "", str(stat.st_mtime_ns), str(stat.st_size)])
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached thumbnail, marking it as recently used.
+
+        Args:
+            key: Cache key from key().
+
+        Returns:
+            The encoded thumbnail as bytes, None if not cached.
+        """
+        path = os.path.join(self._directory, "{0}.png".format(key))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        """
+        Add an encoded thumbnail to the cache, evicting the least recently used thumbnails if over the size cap.
+
+        Args:
+            key: Cache key from key().
+            data: The encoded thumbnail as bytes.
+
+        Returns:
+            Nothing.
+        """
+        path = os.path.join(self._directory, "{0}.png".format(key))
+        temporary = "{0}.{1}.tmp".format(path, threading.get_ident())
+        with open(temporary, "wb") as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._total_bytes -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(temporary, path)
+            self._total_bytes += len(data)
+            if self._total_bytes > self._max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used thumbnails until under the size cap. Must be called while holding _lock.
+
+        Args:
+            Nothing.
+
+        Returns:
+            Nothing.
+        """
+        with os.scandir(self._directory) as it:
+            entries = [(entry.stat(), entry.path) for entry in it if entry.is_file() and entry.name.endswith(".png")]
+        self._total_bytes = sum(stat.st_size for stat, path in entries)
+        for stat, path in sorted(entries, key=lambda e: e[0].st_mtime_ns):
+            if self._total_bytes <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= stat.st_size
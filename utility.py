@@ -1,11 +1,360 @@
 import os
 import os.path
+import sys
 import math
 import subprocess
 import shutil
 import re
+import errno
+import tempfile
+import time
+import io
+import gzip
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from zipfile import *
+from zipfile import ZIP64_LIMIT
 from html.entities import *
+from urllib.parse import unquote
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+LOCK_FILE = ".build.lock"
+SCRATCH_PREFIX = ".scratch-"
+
+TEXT_CHAPTER_EXTENSIONS = {None: ".html", "gzip": ".html.gz", "zstd": ".html.zst"}
+
+STORED_EXTENSIONS = [".jpg", ".jpeg", ".webp", ".gif", ".cbz", ".zip", ".epub", ".gz", ".zst"]
+
+# Writing entries compressed in worker threads relies on ZipFile internals, checked against these Python versions.
+# Other versions compress in ZipFile itself and only read files in worker threads.
+WRITE_PRECOMPRESSED = (3, 8) <= sys.version_info[:2] <= (3, 13)
+
+def _should_deflate(arcname, compression, stored_extensions):
+	"""
+	Checks whether an archive entry should be deflated.
+
+	Args:
+		arcname: Name of the entry in the archive.
+		compression: Either "deflate" or None to store.
+		stored_extensions: List of extensions of already compressed files that are always stored.
+
+	Returns:
+		Bool whether to deflate the entry.
+	"""
+	return compression == "deflate" and os.path.splitext(arcname)[1].lower() not in stored_extensions
+
+def _read_entry(source, arcname):
+	"""
+	Read a file for an archive.
+
+	Args:
+		source: Path to the file.
+		arcname: Name of the entry in the archive.
+
+	Returns:
+		Tuple of ZipInfo for the entry and the content of the file as bytes.
+	"""
+	info = ZipInfo.from_file(source, arcname)
+	with open(source, "rb") as f:
+		return info, f.read()
+
+def _compress_entry(source, arcname, compression, level, stored_extensions):
+	"""
+	Read and compress a file for an archive.
+
+	Args:
+		source: Path to the file.
+		arcname: Name of the entry in the archive.
+		compression: Either "deflate" or None to store.
+		level: Deflate compression level from 0 to 9.
+		stored_extensions: List of extensions of already compressed files that are always stored.
+
+	Returns:
+		Tuple of ZipInfo with sizes and CRC set, and the compressed data as bytes.
+	"""
+	info, data = _read_entry(source, arcname)
+	info.file_size = len(data)
+	info.CRC = zlib.crc32(data)
+	info.compress_type = ZIP_STORED
+	if _should_deflate(arcname, compression, stored_extensions):
+		compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+		compressed = compressor.compress(data) + compressor.flush()
+		if len(compressed) < len(data):
+			info.compress_type = ZIP_DEFLATED
+			data = compressed
+	info.compress_size = len(data)
+	return info, data
+
+def _write_compressed_entry(archive_zip_file, info, data):
+	"""
+	Append an already compressed entry to an archive being written.
+	ZipFile can only compress entries itself, so this writes the local header and data directly
+	and leaves the central directory to ZipFile. This mirrors ZipFile.mkdir and must only be used if WRITE_PRECOMPRESSED.
+
+	Args:
+		archive_zip_file: ZipFile opened for writing.
+		info: ZipInfo from _compress_entry.
+		data: Compressed data from _compress_entry.
+
+	Returns:
+		Nothing.
+	"""
+	zip64 = info.file_size > ZIP64_LIMIT or info.compress_size > ZIP64_LIMIT
+	info.header_offset = archive_zip_file.fp.tell()
+	archive_zip_file.fp.write(info.FileHeader(zip64))
+	archive_zip_file.fp.write(data)
+	archive_zip_file.start_dir = archive_zip_file.fp.tell()
+	archive_zip_file.filelist.append(info)
+	archive_zip_file.NameToInfo[info.filename] = info
+	archive_zip_file._didModify = True
+
+def write_archive(archive, entries, compression=None, level=6, stored_extensions=STORED_EXTENSIONS, workers=None):
+	"""
+	Write files to a zip archive. Entries are read, and where WRITE_PRECOMPRESSED compressed, in parallel worker threads
+	and written in order.
+
+	Args:
+		archive: Path to the archive to write.
+		entries: List of tuples of path to the file and name of the entry in the archive.
+		compression: Either "deflate" to deflate entries that are not already compressed, or None to store every entry.
+		level: Deflate compression level from 0 to 9.
+		stored_extensions: List of extensions of already compressed files that are always stored.
+		workers: Maximum number of entries to compress at once, None for one per CPU.
+
+	Returns:
+		Nothing.
+	"""
+	with ZipFile(archive, "w", ZIP_STORED) as archive_zip_file:
+		if compression is None:
+			for source, arcname in entries:
+				archive_zip_file.write(source, arcname)
+			return
+		if WRITE_PRECOMPRESSED:
+			prepare = lambda source, arcname: _compress_entry(source, arcname, compression, level, stored_extensions)
+			write = lambda info, data: _write_compressed_entry(archive_zip_file, info, data)
+		else:
+			prepare = _read_entry
+			write = lambda info, data: archive_zip_file.writestr(info, data, ZIP_DEFLATED if _should_deflate(info.filename, compression, stored_extensions) else ZIP_STORED, level)
+		workers = workers or os.cpu_count() or 1
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			# Bound how many prepared entries wait in memory to be written.
+			window = workers * 2
+			pending = deque()
+			for source, arcname in entries:
+				pending.append(executor.submit(prepare, source, arcname))
+				if len(pending) >= window:
+					write(*pending.popleft().result())
+			while pending:
+				write(*pending.popleft().result())
+
+def is_text_chapter(name):
+	"""
+	Checks whether a file name is a text chapter, compressed or not.
+
+	Args:
+		name: File name to check.
+
+	Returns:
+		Bool whether name is a text chapter.
+	"""
+	return name.endswith(tuple(TEXT_CHAPTER_EXTENSIONS.values()))
+
+def get_text_chapter_compression(name):
+	"""
+	Get the compression of a text chapter from its file name.
+
+	Args:
+		name: File name of the text chapter.
+
+	Returns:
+		Compression as one of the keys of TEXT_CHAPTER_EXTENSIONS.
+	"""
+	for compression, extension in TEXT_CHAPTER_EXTENSIONS.items():
+		if compression is not None and name.endswith(extension):
+			return compression
+	return None
+
+def get_text_chapter_stem(name):
+	"""
+	Get the file name of a text chapter without its extension.
+
+	Args:
+		name: File name of the text chapter.
+
+	Returns:
+		File name without the extension.
+	"""
+	return name[:-len(TEXT_CHAPTER_EXTENSIONS[get_text_chapter_compression(name)])]
+
+def open_compressed(path, mode, compression):
+	"""
+	Open a binary stream that transparently compresses or decompresses a file.
+
+	Args:
+		path: Path to the file.
+		mode: Either "rb" or "wb".
+		compression: Compression as one of the keys of TEXT_CHAPTER_EXTENSIONS.
+
+	Returns:
+		Binary file object.
+
+	Raises:
+		ImportError: If compression is "zstd" and zstandard is not installed.
+	"""
+	if compression == "gzip":
+		return gzip.open(path, mode)
+	elif compression == "zstd":
+		if zstandard is None:
+			raise ImportError("zstandard is required for zstd compressed text chapters")
+		if mode == "rb":
+			return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")))
+		return zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+	return open(path, mode)
+
+def open_text_chapter(path, mode="r", encoding="utf-8-sig"):
+	"""
+	Open a text chapter as a text stream, compressing or decompressing based on its file name.
+
+	Args:
+		path: Path to the text chapter.
+		mode: Either "r" or "w".
+		encoding: Text encoding of the chapter.
+
+	Returns:
+		Text file object.
+	"""
+	return io.TextIOWrapper(open_compressed(path, mode + "b", get_text_chapter_compression(path)), encoding=encoding)
+
+def read_html_title(html_file):
+	"""
+	Read the title of a html file, only reading as far as the end of the title.
+
+	Args:
+		html_file: Path to the html file, which may be compressed.
+
+	Returns:
+		The title as str, None if there is no title.
+	"""
+	content = ""
+	with open_text_chapter(html_file, "r") as f:
+		while "</title>" not in content:
+			chunk = f.read(4096)
+			if not chunk:
+				break
+			content += chunk
+	start = content.find("<title>")
+	end = content.find("</title>")
+	if start == -1 or end == -1:
+		return None
+	return content[start + len("<title>"): end].strip()
+
+def recompress_text_chapter(html_file, compression):
+	"""
+	Rewrite a text chapter with a different compression, replacing the original.
+
+	Args:
+		html_file: Path to the text chapter.
+		compression: Compression as one of the keys of TEXT_CHAPTER_EXTENSIONS.
+
+	Returns:
+		Path to the rewritten text chapter.
+	"""
+	current = get_text_chapter_compression(html_file)
+	if current == compression:
+		return html_file
+	new_html_file = get_text_chapter_stem(html_file) + TEXT_CHAPTER_EXTENSIONS[compression]
+	temporary = "{0}.tmp".format(new_html_file)
+	try:
+		with open_compressed(html_file, "rb", current) as source:
+			with open_compressed(temporary, "wb", compression) as destination:
+				shutil.copyfileobj(source, destination)
+	except BaseException:
+		if os.path.exists(temporary):
+			os.remove(temporary)
+		raise
+	os.replace(temporary, new_html_file)
+	os.remove(html_file)
+	return new_html_file
+
+def rebase_relative_urls(html_content, source, destination, moved={}):
+	"""
+	Rewrite the relative src and href URLs in html content moved from one directory to another, so they still point to the same files.
+
+	Args:
+		html_content: The html content as str.
+		source: Path to the directory the relative URLs are relative to.
+		destination: Path to the directory the html content is moved to.
+		moved: Dict of absolute paths of files that were moved along with the html content to their new absolute paths.
+			URLs to these files point to the new paths instead.
+
+	Returns:
+		The html content with rewritten URLs.
+	"""
+	pattern = re.compile(r"(\b(?:src|href)\s*=\s*)([\"'])(.*?)\2", re.IGNORECASE | re.DOTALL)
+	def rebase(match):
+		url = match.group(3)
+		if not url or url.startswith(("#", "/", "\\")) or re.match(r"[A-Za-z][A-Za-z0-9+.-]*:", url):
+			return match.group(0)
+		path, suffix = re.match(r"([^?#]*)(.*)", url, re.DOTALL).groups()
+		target = os.path.normpath(os.path.join(os.path.abspath(source), unquote(path)))
+		if target in moved:
+			# Moved files keep their name, so only the directory part changes and any percent encoding is kept.
+			directory = os.path.relpath(os.path.dirname(moved[target]), destination).replace(os.sep, "/")
+			name = path.rsplit("/", 1)[-1]
+			rebased = name if directory == "." else "{0}/{1}".format(directory, name)
+		else:
+			rebased = os.path.relpath(os.path.join(source, path), destination).replace(os.sep, "/")
+		return "{0}{1}{2}{3}{1}".format(match.group(1), match.group(2), rebased, suffix)
+	return pattern.sub(rebase, html_content)
+
+def expand_text_chapters(chapters, destination, css):
+	"""
+	Decompress compressed text chapters so they can be read by Calibre.
+	Relative links in the decompressed copies are rewritten so they still point next to the original chapters,
+	except links to other decompressed chapters by their plain .html name, which point to the decompressed copies.
+
+	Args:
+		chapters: List of paths to individual chapters.
+		destination: Path to the directory to place the decompressed chapters.
+		css: Path to the CSS file the decompressed chapters should link to.
+
+	Returns:
+		List of paths to the chapters, with compressed chapters replaced by their decompressed copies.
+	"""
+	moved = {}
+	for chapter in chapters:
+		if get_text_chapter_compression(chapter) is not None:
+			html_name = os.path.basename(get_text_chapter_stem(chapter)) + TEXT_CHAPTER_EXTENSIONS[None]
+			moved[os.path.join(os.path.dirname(os.path.abspath(chapter)), html_name)] = os.path.join(os.path.abspath(destination), html_name)
+
+	expanded = []
+	for chapter in chapters:
+		compression = get_text_chapter_compression(chapter)
+		if compression is None:
+			expanded.append(chapter)
+			continue
+		if not os.path.exists(destination):
+			os.makedirs(destination)
+		html_file = os.path.join(destination, os.path.basename(get_text_chapter_stem(chapter)) + TEXT_CHAPTER_EXTENSIONS[None])
+		with open_text_chapter(chapter, "r") as source:
+			content = rebase_relative_urls(source.read(), os.path.dirname(os.path.abspath(chapter)), destination, moved)
+		with open(html_file, "w", encoding="utf-8") as html:
+			html.write(content)
+		fix_css(html_file, css)
+		expanded.append(html_file)
+	return expanded
 
 def txt_to_html(txt, entities, css, destination):
 	"""
@@ -20,11 +369,11 @@ def txt_to_html(txt, entities, css, destination):
 	Returns:
 		Converted HTML text.
 	"""
-	entities.remove("\n")
+	entities.discard("\n")
 	content = txt.strip().split("\n\n")
 
 	html = "<!DOCTYPE html>\n<html>\n<head>\n\t<meta charset=\"utf-8\">\n"
-	html += f"\t<link rel=\"stylesheet\" href=\"{os.path.relpath(css_file, destination)}\">\n"
+	html += f"\t<link rel=\"stylesheet\" href=\"{os.path.relpath(css, destination)}\">\n"
 	html += "\t<title>" + content[0] + "</title>\n"
 	html += "</head>\n"
 	html += "<body>\n"
@@ -67,16 +416,10 @@ def generate_text_table_of_contents(chapters, destination, title):
 	content += "\t<p>\n"
 
 	for chapter in chapters:
-		with open(chapter, "r", encoding="utf-8-sig") as html_chapter:
-			html_content = html_chapter.read()
-			start = html_content.find("<title>")
-			end = html_content.find("</title>")
-			length = len("<title>")
-			if start == -1 or end == -1 or html_content[start + length: end].strip() == "":
-				chapter_title = "No Title"
-			else:
-				chapter_title = html_content[start + length: end].strip()
-			content += "\t\t<a href=\"{0}\">{1}</a><br>\n".format("file:///" + chapter, chapter_title)
+		chapter_title = read_html_title(chapter)
+		if not chapter_title:
+			chapter_title = "No Title"
+		content += "\t\t<a href=\"{0}\">{1}</a><br>\n".format("file:///" + chapter, chapter_title)
 
 	content += "\t</p>\n"
 	content += "</body>\n"
@@ -112,7 +455,7 @@ def generate_comic_table_of_contents(chapters, destination):
 		toc.write(content)
 	return txt
 
-def generate_cbc(chapters, destination, txt, title):
+def generate_cbc(chapters, destination, txt, title, **archive_options):
 	"""
 	Generates a .cbc file from .cbz files and a comics.txt table of contents.
 
@@ -121,25 +464,25 @@ def generate_cbc(chapters, destination, txt, title):
 		destination: Path to the directory to place the .cbc file.
 		txt: Path to the comics.txt table of contents file.
 		title: Title of the comic work.
+		**archive_options: Compression options for write_archive.
 
 	Returns:
 		Path to the generated cbc file.
 	"""
 	cbc = os.path.join(destination, "{0}.cbc".format(title))
-	cbc_zip_file = ZipFile(cbc, "w", ZIP_STORED)
-	for chapter in chapters:
-		filename = os.path.basename(chapter)
-		cbc_zip_file.write(chapter, filename)
-	cbc_zip_file.write(txt, os.path.basename(os.path.normpath(txt)))
+	entries = [(chapter, os.path.basename(chapter)) for chapter in chapters]
+	entries.append((txt, os.path.basename(os.path.normpath(txt))))
+	write_archive(cbc, entries, **archive_options)
 	return cbc
 
-def import_comics(sources, destination):
+def import_comics(sources, destination, **archive_options):
 	"""
 	Import comic chapters. Each chapter must be either a .cbz file or a directory with images.
 
 	Args:
 		sources: List of paths to the individual chapters to import.
 		destination: Path to the directory to place the chapters.
+		**archive_options: Compression options for write_archive.
 
 	Returns:
 		Nothing.
@@ -150,7 +493,8 @@ def import_comics(sources, destination):
 			if ext == ".cbz":
 				shutil.copy(source, os.path.join(destination, os.path.basename(os.path.normpath(source))))
 		else:
-			cbz = ZipFile(os.path.join(destination, "{0}.cbz".format(os.path.basename(os.path.normpath(source)))), "w", ZIP_STORED)
+			cbz = os.path.join(destination, "{0}.cbz".format(os.path.basename(os.path.normpath(source))))
+			entries = []
 			with os.scandir(source) as it:
 				file_list = sorted(list(it), key=lambda x: x.name)
 				length = len(file_list)
@@ -158,15 +502,17 @@ def import_comics(sources, destination):
 				for i in range(length):
 					entry = file_list[i]
 					if entry.is_file():
-						cbz.write(entry.path, "{0}{1}".format(str(i + 1).zfill(digits), os.path.splitext(entry.path)[1]))
+						entries.append((entry.path, "{0}{1}".format(str(i + 1).zfill(digits), os.path.splitext(entry.path)[1])))
+			write_archive(cbz, entries, **archive_options)
 
-def import_texts(sources, destination, css):
+def import_texts(sources, destination, css, compression=None):
 	"""
 	Import text chapters. Each chapter must be either a .txt or .html file.
 
 	Args:
 		sources: List of paths to the individual chapters to import.
 		destination: Path to the directory to place the chapters.
+		compression: Compression to store the chapters with as one of the keys of TEXT_CHAPTER_EXTENSIONS.
 
 	Returns:
 		Nothing.
@@ -174,13 +520,16 @@ def import_texts(sources, destination, css):
 	entities = set([v for v in html5.values() if len(v) == 1])
 	for source in sources:
 		if not os.path.isdir(source):
-			ext = os.path.splitext(source)[1]
+			stem, ext = os.path.splitext(os.path.basename(os.path.normpath(source)))
+			html_file = os.path.join(destination, stem + TEXT_CHAPTER_EXTENSIONS[compression])
 			if ext == ".txt":
 				with open(source, "r", encoding="utf-8-sig") as txt:
-					with open(os.path.join(destination, "{0}.html".format(os.path.splitext(os.path.basename(os.path.normpath(source)))[0])), "w", encoding="utf-8") as html:
+					with open_text_chapter(html_file, "w", encoding="utf-8") as html:
 						html.write(txt_to_html(txt.read(), entities, css, destination))
 			elif ext == ".html":
-				shutil.copy(source, os.path.join(destination, os.path.basename(os.path.normpath(source))))
+				with open(source, "rb") as f:
+					with open_compressed(html_file, "wb", compression) as html:
+						shutil.copyfileobj(f, html)
 
 def find_cover(folder, cover_names):
 	"""
@@ -203,15 +552,133 @@ def fix_css(html_file, new_css_file):
 	Fix the absolute css paths in a given html file.
 
 	Args:
-		html_file: Path to the html file.
+		html_file: Path to the html file, which may be compressed.
 		new_css_file: Path to the new css file.
 
 	Returns:
 		Nothing
 	"""
 	pattern = re.compile(r"<link rel=\"stylesheet\" href=\"(?:.*?)\">")
-	with open(html_file, "r", encoding="utf-8-sig") as f:
+	with open_text_chapter(html_file, "r") as f:
 		html_content = f.read()
 	new_html_content = pattern.sub(f"<link rel=\"stylesheet\" href=\"{os.path.relpath(new_css_file, os.path.dirname(html_file))}\">", html_content)
-	with open(html_file, "w", encoding="utf-8-sig") as f:
-		f.write(new_html_content)
\ No newline at end of file
+	with open_text_chapter(html_file, "w") as f:
+		f.write(new_html_content)
+
+def _try_lock(f):
+	"""
+	Try to take an exclusive lock on an open file without blocking.
+
+	Args:
+		f: Open file object to lock.
+
+	Returns:
+		Bool whether the lock was taken.
+	"""
+	try:
+		if fcntl is not None:
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+		else:
+			f.seek(0)
+			msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+	except OSError:
+		return False
+	return True
+
+def _unlock(f):
+	"""
+	Release a lock taken with _try_lock.
+
+	Args:
+		f: Open file object to unlock.
+
+	Returns:
+		Nothing.
+	"""
+	if fcntl is not None:
+		fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+	else:
+		f.seek(0)
+		msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def work_lock(lock_file, wait=True, timeout=None, poll_interval=0.1):
+	"""
+	Hold an exclusive lock on lock_file for the duration of the context.
+	The lock is held by the operating system, so it is released even if the process dies.
+
+	Args:
+		lock_file: Path to the lock file, created if missing.
+		wait: Whether to wait for the lock if it is held elsewhere, otherwise give up immediately.
+		timeout: Seconds to wait for the lock before giving up, None to wait forever.
+		poll_interval: Seconds between attempts to take the lock.
+
+	Yields:
+		Bool whether the lock was taken. Only False if wait is False.
+
+	Raises:
+		TimeoutError: If the lock could not be taken within timeout seconds.
+	"""
+	deadline = None if timeout is None else time.monotonic() + timeout
+	with open(lock_file, "a+") as f:
+		while not _try_lock(f):
+			if not wait:
+				yield False
+				return
+			if deadline is not None and time.monotonic() >= deadline:
+				raise TimeoutError(errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT), lock_file)
+			time.sleep(poll_interval)
+		try:
+			yield True
+		finally:
+			_unlock(f)
+
+def clean_scratch(folder):
+	"""
+	Remove scratch directories left behind in folder by interrupted builds.
+	Must only be called while holding the lock for folder.
+
+	Args:
+		folder: Path to the directory to clean.
+
+	Returns:
+		Nothing.
+	"""
+	with os.scandir(folder) as it:
+		for entry in it:
+			if entry.is_dir() and entry.name.startswith(SCRATCH_PREFIX):
+				shutil.rmtree(entry.path, ignore_errors=True)
+
+def get_device(path):
+	"""
+	Get the device a path is on, so that I/O on different devices can be scheduled separately.
+
+	Args:
+		path: Path to a file or directory.
+
+	Returns:
+		The device number, or the absolute path if path does not exist.
+	"""
+	try:
+		return os.stat(path).st_dev
+	except FileNotFoundError:
+		return os.path.abspath(path)
+
+def make_scratch(folder, name=None):
+	"""
+	Create a private scratch directory inside folder.
+	Keeping it on the same filesystem lets finished files be moved into place atomically.
+
+	Args:
+		folder: Path to the directory to create the scratch directory in.
+		name: Fixed name for the scratch directory after SCRATCH_PREFIX, None for a random name.
+			Only safe while holding the lock for folder.
+
+	Returns:
+		Path to the new scratch directory.
+	"""
+	if name is None:
+		return tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=folder)
+	scratch = os.path.join(folder, SCRATCH_PREFIX + name)
+	os.makedirs(scratch)
+	return scratch
\ No newline at end of file